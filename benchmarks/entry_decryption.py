@@ -0,0 +1,96 @@
+"""
+Compare reading small encrypted entries with `Entry.read_bytes` against the per-entry path it replaced, which parsed
+the wrapped key with construct, unwrapped it on every read and decrypted through a buffered `DecryptedEntryFile`.
+Re-reads cycle over a set of entries small enough for the unwrapped keys cache.
+
+    python -m benchmarks.entry_decryption --entries 100000 --size 4096
+"""
+import argparse
+import hashlib
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from construct import GreedyBytes, Int32ul, Struct
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap, aes_key_wrap
+
+from pyiosbackup import Backup
+from pyiosbackup.entry import Entry
+from pyiosbackup.entry_file import ZERO_IV, DecryptedEntryFile
+from pyiosbackup.keybag import Keybag
+from pyiosbackup.manifest_plist import ManifestPlist
+
+PROTECTION_CLASS = 3
+# The wrapped key struct parser entries keys went through before.
+encryption_key_struct = Struct(
+    'class_' / Int32ul,
+    'key' / GreedyBytes
+)
+
+
+def create_backup(path: Path, entries: int, size: int):
+    """
+    Create an encrypted backup of entries of random data, each with its own key.
+    :return: Class key and the entries.
+    """
+    class_key = os.urandom(32)
+    backup = Backup(path, None, ManifestPlist({'IsEncrypted': True, 'Lockdown': {'ProductVersion': '14.0'}}), {}, {},
+                    Keybag({PROTECTION_CLASS: class_key}))
+    timestamp = datetime.fromtimestamp(1628082463, timezone.utc)
+    backup_entries = []
+    for i in range(entries):
+        key = os.urandom(32)
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        encryptor = Cipher(algorithms.AES(key), modes.CBC(ZERO_IV)).encryptor()
+        file_id = hashlib.sha1(f'MediaDomain-{i}'.encode()).hexdigest()
+        entry = Entry(backup, file_id, 'MediaDomain', f'Library/SMS/Attachments/{i}.jpg', timestamp, timestamp,
+                      timestamp, size, 0o100644, 501, 501,
+                      PROTECTION_CLASS.to_bytes(4, 'little') + aes_key_wrap(class_key, key))
+        entry.real_path.parent.mkdir(exist_ok=True)
+        entry.real_path.write_bytes(
+            encryptor.update(padder.update(os.urandom(size)) + padder.finalize()) + encryptor.finalize())
+        backup_entries.append(entry)
+    return class_key, backup_entries
+
+
+def read_before(entry: Entry, class_key: bytes) -> bytes:
+    parsed_key = encryption_key_struct.parse(entry.encryption_key)
+    key = aes_key_unwrap({PROTECTION_CLASS: class_key}[parsed_key.class_], parsed_key.key)
+    with io.BufferedReader(DecryptedEntryFile(entry.real_path, key)) as file:
+        return file.read()
+
+
+def timed(func, entries) -> float:
+    start = time.perf_counter()
+    for entry in entries:
+        func(entry)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--rereads', type=int, default=20000)
+    parser.add_argument('--hot-entries', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        class_key, entries = create_backup(Path(temp_dir), args.entries, args.size)
+        rereads = [entries[i % args.hot_entries] for i in range(args.rereads)]
+        for name, read in (('before', lambda entry: read_before(entry, class_key)), ('read_bytes', Entry.read_bytes)):
+            # Every run starts with an empty unwrapped keys cache, with the entries data in the page cache.
+            entries[0].backup.keybag = Keybag({PROTECTION_CLASS: class_key})
+            timed(read, entries)
+            entries[0].backup.keybag = Keybag({PROTECTION_CLASS: class_key})
+            print(f'{name}: reading {len(entries)} entries {timed(read, entries):.2f}s, '
+                  f're-reading {len(rereads)} of them {timed(read, rereads):.2f}s')
+
+
+if __name__ == '__main__':
+    main()
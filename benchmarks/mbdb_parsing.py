@@ -0,0 +1,157 @@
+"""
+Compare loading a Manifest.mbdb with `ManifestDbMbdb` against the construct based parser it replaced.
+Every parser runs in its own process, so its peak RSS is measured on its own. Records are synthetic, with a digest,
+an encryption key and an extended attribute each.
+
+    python -m benchmarks.mbdb_parsing --records 200000
+"""
+import argparse
+import hashlib
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from construct import Array, Byte, Bytes, Computed, Const, GreedyRange, IfThenElse, Int16ub, Int32ub, Int64ub, \
+    PaddedString, Struct, this
+
+from pyiosbackup.manifest_dbs.mbdb import MBDB_HEADER, ManifestDbMbdb
+
+PARSERS = ('construct', 'streaming')
+
+# The parser `ManifestDbMbdb` used before parsing records lazily.
+mbdb_struct = Struct(
+    Const(b'mbdb', Bytes(4)),
+    'version' / Const(b'\x05\x00', Bytes(2)),
+    'records' / GreedyRange(Struct(
+        'domain_len' / Int16ub,
+        'domain' / IfThenElse(this.domain_len != 0xffff, PaddedString(this.domain_len, 'utf8'), Computed('')),
+        'filename_len' / Int16ub,
+        'filename' / IfThenElse(this.filename_len != 0xffff, PaddedString(this.filename_len, 'utf8'), Computed('')),
+        'link_len' / Int16ub,
+        'linktarget' / IfThenElse(this.link_len != 0xffff, PaddedString(this.link_len, 'utf8'), Computed('')),
+        'hash_len' / Int16ub,
+        'data_hash' / IfThenElse(this.hash_len != 0xffff, Bytes(this.hash_len), Computed(b'')),
+        'key_length' / Int16ub,
+        'encryption_key' / IfThenElse(this.key_length != 0xffff, Bytes(this.key_length), Computed(b'')),
+        'mode' / Int16ub,
+        'unknown2' / Int32ub,
+        'unknown3' / Int32ub,
+        'user_id' / Int32ub,
+        'group_id' / Int32ub,
+        'mtime' / Int32ub,
+        'atime' / Int32ub,
+        'ctime' / Int32ub,
+        'size' / Int64ub,
+        'flags' / Byte,
+        'properties_count' / Byte,
+        'properties' / Array(this.properties_count, Struct(
+            'name_len' / Int16ub,
+            'name' / IfThenElse(this.name_len != 0xffff, PaddedString(this.name_len, 'utf8'), Computed('')),
+            'value_len' / Int16ub,
+            'value' / IfThenElse(this.value_len != 0xffff, PaddedString(this.value_len, 'utf8'), Computed('')),
+        )),
+    ))
+)
+
+
+def mbdb_string(value: bytes) -> bytes:
+    return struct.pack('>H', len(value)) + value
+
+
+def relative_path(i: int) -> str:
+    return f'Library/SMS/Attachments/{i % 256:02x}/{i:08d}/IMG_{i:06d}.JPG'
+
+
+def write_mbdb(path: Path, records: int):
+    with open(path, 'wb') as mbdb:
+        mbdb.write(MBDB_HEADER)
+        for i in range(records):
+            mbdb.write(b''.join(mbdb_string(value) for value in (
+                b'MediaDomain', relative_path(i).encode(), b'', hashlib.sha1(str(i).encode()).digest(),
+                b'\x03\x00\x00\x00' + i.to_bytes(4, 'big') * 10,
+            )))
+            mbdb.write(struct.pack('>HIIIIIIIQBB', 0o100644, 0, 0, 501, 501, 1628082463, 1628082463, 1627974948,
+                                   i * 97, 0, 1))
+            mbdb.write(mbdb_string(b'com.apple.assetsd.UUID') + mbdb_string(b'%036d' % i))
+
+
+def load_with_construct(path: Path):
+    """
+    Load every record the way `ManifestDbMbdb` did before parsing records lazily.
+    """
+    records = []
+    for record in mbdb_struct.parse(path.read_bytes()).records:
+        domain = record['domain']
+        filename = record['filename']
+        records.append({
+            'file_id': hashlib.sha1(f'{domain}-{filename}'.encode()).hexdigest(),
+            'domain': domain,
+            'relative_path': filename,
+            'last_modified': datetime.fromtimestamp(record['mtime'], timezone.utc),
+            'created': datetime.fromtimestamp(record['ctime'], timezone.utc),
+            'last_status_change': datetime.fromtimestamp(record['atime'], timezone.utc),
+            'size': record['size'],
+            'mode': record['mode'],
+            'group_id': record['group_id'],
+            'user_id': record['user_id'],
+            'encryption_key': record['encryption_key'],
+        })
+    return records
+
+
+def measure(parser: str, path: Path, lookup_id: str):
+    """
+    Time loading, iterating and a first lookup by ID, then print the timings and the peak RSS of this process.
+    """
+    start = time.perf_counter()
+    if parser == 'construct':
+        records = load_with_construct(path)
+        loaded = time.perf_counter()
+        for _ in records:
+            pass
+        iterated = time.perf_counter()
+        ids_index = {}
+        for index, record in enumerate(records):
+            ids_index.setdefault(record['file_id'], index)
+        assert records[ids_index[lookup_id]]['file_id'] == lookup_id
+    else:
+        manifest_db = ManifestDbMbdb.from_path(path, None, None)
+        loaded = time.perf_counter()
+        for _ in manifest_db.get_all_entries():
+            pass
+        iterated = time.perf_counter()
+        assert manifest_db.get_metadata_by_id(lookup_id)['file_id'] == lookup_id
+    looked_up = time.perf_counter()
+    # Linux reports the peak RSS in KiB, macOS in bytes.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    print(f'{parser}: load {loaded - start:.2f}s, full iteration {iterated - loaded:.2f}s, '
+          f'first lookup {looked_up - iterated:.2f}s, peak RSS {peak_rss:.0f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--measure', nargs=3, metavar=('PARSER', 'PATH', 'LOOKUP_ID'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure is not None:
+        parser_name, path, lookup_id = args.measure
+        measure(parser_name, Path(path), lookup_id)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / ManifestDbMbdb.NAME
+        write_mbdb(path, args.records)
+        print(f'{args.records} records, {path.stat().st_size / 1024 ** 2:.0f} MiB')
+        lookup_id = hashlib.sha1(f'MediaDomain-{relative_path(args.records - 1)}'.encode()).hexdigest()
+        for parser_name in PARSERS:
+            subprocess.run([sys.executable, '-m', 'benchmarks.mbdb_parsing', '--measure', parser_name, str(path),
+                            lookup_id], check=True)
+
+
+if __name__ == '__main__':
+    main()
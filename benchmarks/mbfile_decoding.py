@@ -0,0 +1,64 @@
+"""
+Compare decoding MBFile archives with `decode_mbfile` against bpylist2's generic archiver.
+Rows are synthetic, with the fields iOS writes, and half of them with extended attributes.
+
+    python -m benchmarks.mbfile_decoding --rows 50000 --repeat 3
+"""
+import argparse
+import time
+from pathlib import Path
+from unittest import mock
+
+from bpylist2 import archiver
+
+from pyiosbackup.manifest_dbs import sqlite3 as manifest_db_sqlite3
+from pyiosbackup.manifest_dbs.mbfile import decode_mbfile
+from pyiosbackup.manifest_dbs.sqlite3 import ManifestDbSqlite3
+from tests.conftest import archived_mbfile, files_db
+
+
+def manifest_db(archives) -> ManifestDbSqlite3:
+    return ManifestDbSqlite3(Path(ManifestDbSqlite3.NAME), files_db(
+        (f'{i:040x}', 'AppDomain-com.example.app', f'Library/Caches/com.example.app/file-{i}.db', 1, archive)
+        for i, archive in enumerate(archives)
+    ))
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        times.append(time.process_time() - start)
+    return min(times)
+
+
+def compare(name: str, generic, fast, repeat: int):
+    generic_time = best_time(generic, repeat)
+    fast_time = best_time(fast, repeat)
+    print(f'{name}: archiver {generic_time:.2f}s, decode_mbfile {fast_time:.2f}s ({generic_time / fast_time:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    archives = [archived_mbfile(f'Library/Caches/com.example.app/file-{i}.db', extended_attributes=bool(i % 2),
+                                size=i * 97, last_modified=1628082463 + i) for i in range(args.rows)]
+    compare('decoding only', lambda: [archiver.unarchive(archive) for archive in archives],
+            lambda: [decode_mbfile(archive) for archive in archives], args.repeat)
+
+    db = manifest_db(archives)
+
+    def get_all_entries_with_archiver():
+        with mock.patch.object(manifest_db_sqlite3, 'decode_mbfile', archiver.unarchive):
+            list(db.get_all_entries())
+
+    compare('get_all_entries', get_all_entries_with_archiver, lambda: list(db.get_all_entries()), args.repeat)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,21 @@
+import functools
+import json
 import logging
+import os
 import pprint
+import re
+import zipfile
 
 import click
 
 from pyiosbackup import Backup
+from pyiosbackup.content_store import ContentStore
+from pyiosbackup.key_cache import KeyCache
+from pyiosbackup.manifest_cache import ManifestCache
+from pyiosbackup.search import MEDIA_SUFFIXES, compile_pattern
+from pyiosbackup.server import BackupServer
+
+DIFF_SYMBOLS = {'added': '+', 'removed': '-', 'modified': 'M'}
 
 logger = logging.getLogger('pyiosbackup')
 logger.setLevel(logging.INFO)
@@ -21,9 +33,53 @@ password_argument = click.argument('password')
 password_option = click.option('-p', '--password', default='')
 target_option = click.option('--target', type=click.Path(), default='.')
 strict_option = click.option('--strict', is_flag=True)
+jobs_option = click.option('-j', '--jobs', type=click.IntRange(min=1), default=1)
+resume_option = click.option('--resume', is_flag=True)
+cache_path_argument = click.argument('cache_path', type=click.Path(file_okay=False))
 verbosity = click.option('-v', '--verbosity', count=True, callback=set_verbosity, expose_value=False)
 
 
+def key_cache_options(func):
+    @click.option('--key-cache', type=click.Path(file_okay=False), envvar='PYIOSBACKUP_KEY_CACHE')
+    @click.option('--key-cache-ttl', type=float)
+    @functools.wraps(func)
+    def wrapper(*args, key_cache, key_cache_ttl, **kwargs):
+        key_cache = KeyCache(key_cache, key_cache_ttl) if key_cache else None
+        return func(*args, key_cache=key_cache, **kwargs)
+
+    return wrapper
+
+
+def store_option(func):
+    @click.option('--store', type=click.Path(file_okay=False), envvar='PYIOSBACKUP_STORE')
+    @functools.wraps(func)
+    def wrapper(*args, store, **kwargs):
+        if not store:
+            return func(*args, store=None, **kwargs)
+        with ContentStore(store) as content_store:
+            return func(*args, store=content_store, **kwargs)
+
+    return wrapper
+
+
+def manifest_cache_options(func):
+    @click.option('--manifest-cache', type=click.Path(file_okay=False), envvar='PYIOSBACKUP_MANIFEST_CACHE')
+    @click.option('--manifest-cache-size', type=click.IntRange(min=0))
+    @functools.wraps(func)
+    def wrapper(*args, manifest_cache, manifest_cache_size, **kwargs):
+        manifest_cache = ManifestCache(manifest_cache, manifest_cache_size) if manifest_cache else None
+        return func(*args, manifest_cache=manifest_cache, **kwargs)
+
+    return wrapper
+
+
+def write_check_report(ctx, result, report):
+    json.dump(result, report, indent=4)
+    report.write('\n')
+    if result['problems']:
+        ctx.exit(1)
+
+
 @click.group()
 def cli():
     pass
@@ -36,11 +92,13 @@ def cli():
 @password_option
 @target_option
 @strict_option
+@key_cache_options
+@manifest_cache_options
 @verbosity
-def extract_domain_path(backup_path, domain, relative_path, password, target, strict):
+def extract_domain_path(backup_path, domain, relative_path, password, target, strict, key_cache, manifest_cache):
     """ Extract a file from backup, given its domain and relative path."""
-    backup = Backup.from_path(backup_path, password)
-    backup.extract_domain_and_path(domain, relative_path, target, strict)
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        backup.extract_domain_and_path(domain, relative_path, target, strict)
 
 
 @cli.command()
@@ -49,11 +107,13 @@ def extract_domain_path(backup_path, domain, relative_path, password, target, st
 @password_option
 @target_option
 @strict_option
+@key_cache_options
+@manifest_cache_options
 @verbosity
-def extract_id(backup_path, file_id, password, target, strict):
+def extract_id(backup_path, file_id, password, target, strict, key_cache, manifest_cache):
     """ Extract a file from backup, given its file ID."""
-    backup = Backup.from_path(backup_path, password)
-    backup.extract_file_id(file_id, target, strict)
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        backup.extract_file_id(file_id, target, strict)
 
 
 @cli.command()
@@ -61,11 +121,16 @@ def extract_id(backup_path, file_id, password, target, strict):
 @password_argument
 @target_option
 @strict_option
+@jobs_option
+@resume_option
+@store_option
+@key_cache_options
+@manifest_cache_options
 @verbosity
-def extract_all(backup_path, password, target, strict):
+def extract_all(backup_path, password, target, strict, jobs, resume, store, key_cache, manifest_cache):
     """ Decrypt all files in a backup."""
-    backup = Backup.from_path(backup_path, password)
-    backup.extract_all(target, strict)
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        backup.extract_all(target, strict, jobs, resume, store)
 
 
 @cli.command()
@@ -73,21 +138,175 @@ def extract_all(backup_path, password, target, strict):
 @password_argument
 @target_option
 @strict_option
+@jobs_option
+@resume_option
+@store_option
+@key_cache_options
+@manifest_cache_options
 @verbosity
-def unback(backup_path, password, target, strict):
+def unback(backup_path, password, target, strict, jobs, resume, store, key_cache, manifest_cache):
     """ Decrypt all files in a backup to a filesystem layout."""
-    backup = Backup.from_path(backup_path, password)
-    backup.unback(target, strict)
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        backup.unback(target, strict, jobs, resume, store)
+
+
+@cli.command()
+@backup_path_argument
+@password_argument
+@target_option
+@strict_option
+@jobs_option
+@click.option('--keep-removed', is_flag=True)
+@click.option('--report', type=click.File('w'))
+@store_option
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def unback_delta(backup_path, password, target, strict, jobs, keep_removed, report, store, key_cache, manifest_cache):
+    """ Update a previous `unback --resume` extraction with the files that changed since."""
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        changes = backup.unback_delta(target, strict, jobs, not keep_removed, store)
+        if report is not None:
+            json.dump(changes, report, indent=4)
+
+
+@cli.command()
+@backup_path_argument
+@click.argument('output', type=click.File('wb'))
+@password_option
+@click.option('--format', 'archive_format', type=click.Choice(['tar', 'zip']), default='tar')
+@click.option('--compress', is_flag=True)
+@strict_option
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def export(backup_path, output, password, archive_format, compress, strict, key_cache, manifest_cache):
+    """ Write all files in a backup to a tar or zip archive in a filesystem layout, use `-` for stdout."""
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        if archive_format == 'zip':
+            backup.export_zip(output, strict, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        else:
+            backup.export_tar(output, strict)
+
+
+@cli.command()
+@backup_path_argument
+@click.argument('pattern')
+@password_option
+@click.option('-F', '--fixed-strings', is_flag=True)
+@click.option('-i', '--ignore-case', is_flag=True)
+@click.option('--domain', 'domains', multiple=True)
+@click.option('--max-size', type=click.IntRange(min=0))
+@click.option('--search-media', is_flag=True)
+@strict_option
+@jobs_option
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def grep(backup_path, pattern, password, fixed_strings, ignore_case, domains, max_size, search_media, strict, jobs,
+         key_cache, manifest_cache):
+    """ Search the content of all files in a backup, printing the offsets of matches."""
+    regex = compile_pattern(re.escape(pattern) if fixed_strings else pattern, re.IGNORECASE if ignore_case else 0)
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        hits = backup.search(regex, domains or None, max_size, () if search_media else MEDIA_SUFFIXES, jobs, strict)
+        for entry, offset in hits:
+            click.echo(f'{entry.domain} {entry.relative_path}:{offset}')
 
 
 @cli.command()
 @backup_path_argument
 @password_option
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=os.cpu_count() or 1)
+@click.option('--report', type=click.File('w'), default='-')
+@key_cache_options
+@manifest_cache_options
 @verbosity
-def stats(backup_path, password):
+@click.pass_context
+def verify(ctx, backup_path, password, jobs, report, key_cache, manifest_cache):
+    """ Verify the data of all files in a backup, writing a JSON report. Exits with 1 if any problem is found."""
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        result = backup.verify(jobs)
+    write_check_report(ctx, result, report)
+
+
+@cli.command()
+@backup_path_argument
+@password_option
+@click.option('--report', type=click.File('w'), default='-')
+@key_cache_options
+@manifest_cache_options
+@verbosity
+@click.pass_context
+def quick_check(ctx, backup_path, password, report, key_cache, manifest_cache):
+    """ Check that all files in a backup exist with the expected sizes, without decrypting them."""
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        result = backup.quick_check()
+    write_check_report(ctx, result, report)
+
+
+@cli.command()
+@backup_path_argument
+@password_option
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', type=click.IntRange(min=0, max=65535), default=8000)
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def serve(backup_path, password, host, port, key_cache, manifest_cache):
+    """ Serve the files in a backup over HTTP, decrypting them on demand."""
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup, \
+            BackupServer(backup, (host, port)) as server:
+        logger.info(f'Serving {backup_path} on http://{host}:{server.server_address[1]}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command()
+@backup_path_argument
+@click.argument('other_backup_path', type=click.Path(exists=True))
+@password_option
+@click.option('--other-password')
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def diff(backup_path, other_backup_path, password, other_password, key_cache, manifest_cache):
+    """ Show entries added, removed or modified between two backups, without reading their files."""
+    other_password = password if other_password is None else other_password
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup, \
+            Backup.from_path(other_backup_path, other_password, key_cache, manifest_cache) as other:
+        for change, entry, other_entry in backup.diff(other):
+            entry = other_entry if entry is None else entry
+            click.echo(f'{DIFF_SYMBOLS[change]} {entry.domain} {entry.relative_path}')
+
+
+@cli.command()
+@backup_path_argument
+@password_option
+@key_cache_options
+@manifest_cache_options
+@verbosity
+def stats(backup_path, password, key_cache, manifest_cache):
     """ Show statistics about a backup."""
-    backup = Backup.from_path(backup_path, password)
-    pprint.pprint(backup.stats())
+    with Backup.from_path(backup_path, password, key_cache, manifest_cache) as backup:
+        pprint.pprint(backup.stats())
+
+
+@cli.command()
+@cache_path_argument
+@verbosity
+def clear_key_cache(cache_path):
+    """ Remove all keys from a key cache."""
+    KeyCache(cache_path).clear()
+
+
+@cli.command()
+@cache_path_argument
+@verbosity
+def clear_manifest_cache(cache_path):
+    """ Remove all decrypted Manifest.db files from a manifest cache."""
+    ManifestCache(cache_path).clear()
 
 
 def main():
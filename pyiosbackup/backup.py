@@ -1,18 +1,41 @@
+import io
+import itertools
 import logging
 import plistlib
+import posixpath
 import shutil
+import struct
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Optional
 
 from packaging.version import Version
 
-from pyiosbackup.entry import Entry
+from pyiosbackup.content_store import ContentStore
+from pyiosbackup.entry import HASH_DIRECTORIES_MIN_VERSION, Entry, EntryKind, LazyEntry
 from pyiosbackup.exceptions import BackupPasswordIsRequired, CorruptedEntryError
+from pyiosbackup.extraction_journal import ExtractionJournal
+from pyiosbackup.key_cache import KeyCache
 from pyiosbackup.keybag import Keybag
+from pyiosbackup.manifest_cache import ManifestCache
 from pyiosbackup.manifest_dbs.factory import from_path as manifest_db_from_path
 from pyiosbackup.manifest_dbs.manifest_db_interface import ManifestDb
 from pyiosbackup.manifest_plist import ManifestPlist
+from pyiosbackup.search import MEDIA_SUFFIXES, compile_pattern, search_file
+from pyiosbackup.verification import Problem, check_stored_size, problem_report, scan_stored_files, verify_entry
 
 INFO_PLIST_PATH = 'Info.plist'
+# Oldest modification time a zip archive can hold.
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# Info-ZIP Unix extra field (0x7875), holding the owner's user and group ids.
+zip_unix_extra_struct = struct.Struct('<HHBBIBI')
+ZIP_UNIX_EXTRA_ID = 0x7875
+# Metadata compared by `Backup.diff`.
+DIFF_FIELDS = ('size', 'mode', 'last_modified', 'user_id', 'group_id')
+IN_FLIGHT_PER_WORKER = 4
 STATUS_PLIST_PATH = 'Status.plist'
 
 logger = logging.getLogger('pyiosbackup')
@@ -25,7 +48,7 @@ class Backup:
         """
         Create a Backup object.
         :param backup_path: Path to the original backup.
-        :param manifest_db: Path to a decrypted Manifest.db.
+        :param manifest_db: Loaded Manifest.db.
         :param manifest_plist: Manifest plist.
         :param dict status: Loaded Status.plist.
         :param dict info: Loaded Info.plist.
@@ -37,13 +60,19 @@ class Backup:
         self._manifest_plist = manifest_plist
         self._status = status
         self._info = info
+        # Mapping between domains and their directories children, built for each domain on first use.
+        self._children_index = {}
+        self._children_index_complete = False
 
     @staticmethod
-    def from_path(backup_path: Path, password: str = ''):
+    def from_path(backup_path: Path, password: str = '', key_cache: Optional[KeyCache] = None,
+                  manifest_cache: Optional[ManifestCache] = None):
         """
         Create a backup object from a backup directory.
         :param backup_path: Path to a backup directory.
         :param password: Password to decrypt backup, if not encrypted password should be an empty string.
+        :param key_cache: Cache of password derived keys, skipping the key derivation when reopening a backup.
+        :param manifest_cache: Cache of decrypted Manifest.db files, skipping the decryption when reopening a backup.
         :return: Backup object.
         :rtype: Backup
         """
@@ -57,12 +86,24 @@ class Backup:
         if password and not manifest.is_encrypted:
             logger.warning('Password supplied for not encrypted backup')
 
-        keybag = Keybag.from_manifest(manifest, password) if manifest.is_encrypted else None
-        manifest_db = manifest_db_from_path(backup_path, manifest, keybag)
+        keybag = Keybag.from_manifest(manifest, password, key_cache) if manifest.is_encrypted else None
+        manifest_db = manifest_db_from_path(backup_path, manifest, keybag, manifest_cache)
         info = plistlib.loads((backup_path / INFO_PLIST_PATH).read_bytes())
         status = plistlib.loads((backup_path / STATUS_PLIST_PATH).read_bytes())
         return Backup(backup_path, manifest_db, manifest, status, info, keybag)
 
+    def close(self):
+        """
+        Release resources held by the backup, such as the decrypted Manifest.db.
+        """
+        self._manifest_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     @property
     def date(self):
         """
@@ -98,26 +139,70 @@ class Backup:
     def is_encrypted(self) -> bool:
         return self._manifest_plist.is_encrypted
 
-    def unback(self, path='.', strict: bool = False):
+    def unback(self, path='.', strict: bool = False, workers: int = 1, resume: bool = False,
+               store: Optional[ContentStore] = None):
         """
         Extract all decrypted files from a backup in a filesystem layout
         :param path: Path to destination directory.
         :param strict: Raise exception on extracting errors.
+        :param workers: Number of files to extract in parallel.
+        :param resume: Record extracted files in a journal inside the destination directory, and skip files a previous
+        resumable extraction already completed.
+        :param store: Content store to write files data to, extracted files are then links to the stored data.
         """
         logger.info(f'Extracting backup to {path}')
         dest_dir = Path(path)
         dest_dir.mkdir(exist_ok=True, parents=True)
-        for file in self.iter_files():
-            dest_file = dest_dir / file.domain / file.relative_path
-            logger.debug(f'Extracting file {file.filename} to {dest_file}')
-            dest_file.parent.mkdir(exist_ok=True, parents=True)
-            self._extract_and_write_entry_content(file, dest_file, strict)
+        self._extract_entries(((file, dest_dir / file.domain / file.relative_path) for file in self.iter_files()),
+                              strict, workers, dest_dir if resume else None, store)
+
+    def unback_delta(self, path='.', strict: bool = False, workers: int = 1, delete_removed: bool = True,
+                     store: Optional[ContentStore] = None):
+        """
+        Update a previous resumable `unback` extraction, only extracting files that changed since.
+        Files are compared by their ID, size and modification time against the extraction journal, so only the manifest
+        is read for unchanged files.
+        :param path: Path to the previous extraction directory.
+        :param strict: Raise exception on extracting errors.
+        :param workers: Number of files to extract in parallel.
+        :param delete_removed: Delete the extracted files of entries that are no longer in the backup. Otherwise, they
+        are kept but no longer tracked by the journal.
+        :param store: Content store to write files data to, extracted files are then links to the stored data.
+        :return: Change report, lists of (domain, relative path) pairs of added, modified and removed files, and the
+        number of unchanged files.
+        :rtype: dict
+        """
+        logger.info(f'Updating extraction in {path}')
+        dest_dir = Path(path)
+        dest_dir.mkdir(exist_ok=True, parents=True)
+        report = {'added': [], 'modified': [], 'removed': [], 'unchanged': 0}
+        file_ids = set()
 
-    def extract_all(self, path='.', strict: bool = False):
+        with ExtractionJournal.from_directory(dest_dir) as journal:
+            self._run_extraction(self._iter_changed_entries(journal, dest_dir, report, file_ids), strict, workers,
+                                 journal, store)
+            for file_id, domain, relative_path, dest in journal.iter_records():
+                if file_id in file_ids:
+                    continue
+                logger.debug(f'Removing file {relative_path} of {domain}')
+                report['removed'].append((domain, relative_path))
+                if delete_removed and dest.exists():
+                    dest.unlink()
+                journal.remove(file_id)
+        logger.info(f'{len(report["added"])} added, {len(report["modified"])} modified, {len(report["removed"])} '
+                    f'removed and {report["unchanged"]} unchanged files')
+        return report
+
+    def extract_all(self, path='.', strict: bool = False, workers: int = 1, resume: bool = False,
+                    store: Optional[ContentStore] = None):
         """
         Extract all decrypted files from a backup.
         :param path: Path to destination directory.
         :param strict: Raise exception on extracting errors.
+        :param workers: Number of files to extract in parallel.
+        :param resume: Record extracted files in a journal inside the destination directory, and skip files a previous
+        resumable extraction already completed.
+        :param store: Content store to write files data to, extracted files are then links to the stored data.
         """
         logger.info(f'Extracting backup to {path}')
         dest_dir = Path(path)
@@ -126,13 +211,67 @@ class Backup:
         shutil.copy2(self.path / ManifestPlist.NAME, dest_dir / ManifestPlist.NAME)
         shutil.copy2(self.path / INFO_PLIST_PATH, dest_dir / INFO_PLIST_PATH)
         shutil.copy2(self.path / STATUS_PLIST_PATH, dest_dir / STATUS_PLIST_PATH)
-        shutil.copy2(self._manifest_db.path, dest_dir / self._manifest_db.NAME)
+        self._manifest_db.save(dest_dir / self._manifest_db.NAME)
+
+        self._extract_entries(((file, dest_dir / file.hash_path) for file in self.iter_files()), strict, workers,
+                              dest_dir if resume else None, store)
+
+    def export_tar(self, fileobj, strict: bool = False):
+        """
+        Export all entries as a tar archive, in a filesystem layout like `unback`, without extracting them to disk.
+        The archive is written sequentially, so it can be streamed to a pipe or to stdout.
+        :param fileobj: Binary file object to write the archive to.
+        :param strict: Raise exception on corrupted entries, instead of skipping them.
+        """
+        with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for entry, name, data in self._iter_export_entries(strict):
+                info = tarfile.TarInfo(name)
+                info.mode = entry.mode & 0o7777
+                info.uid = entry.user_id
+                info.gid = entry.group_id
+                info.mtime = entry.last_modified.timestamp()
+                if entry.is_dir():
+                    info.type = tarfile.DIRTYPE
+                elif entry.is_symlink():
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = entry.link_target
+                if data is not None:
+                    info.size = data.seek(0, io.SEEK_END)
+                    data.seek(0)
+                tar.addfile(info, data)
 
-        for file in self.iter_files():
-            dest_file = dest_dir / file.hash_path
-            logger.debug(f'Extracting file {file.filename} to {dest_file}')
-            dest_file.parent.mkdir(exist_ok=True, parents=True)
-            self._extract_and_write_entry_content(file, dest_file, strict)
+    def export_zip(self, fileobj, strict: bool = False, compression: int = zipfile.ZIP_STORED):
+        """
+        Export all entries as a zip archive, in a filesystem layout like `unback`, without extracting them to disk.
+        Modes and symbolic links are kept as Unix attributes, owners in an Info-ZIP Unix extra field. The archive can be
+        streamed to a pipe or to stdout.
+        :param fileobj: Binary file object to write the archive to.
+        :param strict: Raise exception on corrupted entries, instead of skipping them.
+        :param compression: Zip compression method, e.g. zipfile.ZIP_DEFLATED.
+        """
+        with zipfile.ZipFile(fileobj, 'w', compression) as archive:
+            for entry, name, data in self._iter_export_entries(strict):
+                date_time = max(time.localtime(entry.last_modified.timestamp())[:6], ZIP_MIN_DATE_TIME)
+                info = zipfile.ZipInfo(f'{name}/' if entry.is_dir() else name, date_time)
+                info.create_system = 3
+                info.external_attr = (entry.mode & 0xFFFF) << 16
+                info.extra = zip_unix_extra_struct.pack(ZIP_UNIX_EXTRA_ID, zip_unix_extra_struct.size - 4, 1, 4,
+                                                        entry.user_id, 4, entry.group_id)
+                if entry.is_dir():
+                    # MS-DOS directory attribute.
+                    info.external_attr |= 0x10
+                    archive.writestr(info, b'')
+                elif entry.is_symlink():
+                    # Symbolic links content is their target.
+                    archive.writestr(info, entry.link_target)
+                elif data is not None:
+                    info.compress_type = compression
+                    info.file_size = data.seek(0, io.SEEK_END)
+                    data.seek(0)
+                    with archive.open(info, 'w') as dest:
+                        shutil.copyfileobj(data, dest)
+                else:
+                    archive.writestr(info, b'')
 
     def extract_file_id(self, file_id: str, path='.', strict: bool = False):
         """
@@ -180,18 +319,219 @@ class Backup:
         """
         return Entry(self, **self._manifest_db.get_metadata_by_domain_and_path(domain, relative_path))
 
-    def iter_entries(self):
+    def get_entries_by_ids(self, file_ids):
+        """
+        Get several entries by their ids, using a few queries instead of one per entry.
+        :param file_ids: Iterable of entries IDs.
+        :return: Mapping between IDs and parsed entry objects, None for missing entries.
+        :rtype: dict
+        """
+        return {
+            file_id: None if metadata is None else Entry(self, **metadata)
+            for file_id, metadata in self._manifest_db.get_metadata_by_ids(file_ids).items()
+        }
+
+    def get_entries_by_domain_and_paths(self, domains_and_paths):
+        """
+        Get several entries by their domains and paths, using a few queries instead of one per entry.
+        :param domains_and_paths: Iterable of (domain, relative path) pairs, e.g.
+        [('RootDomain', 'Library/Preferences/com.apple.backupd.plist')].
+        :return: Mapping between (domain, relative path) pairs and parsed entry objects, None for missing entries.
+        :rtype: dict
+        """
+        return {
+            domain_and_path: None if metadata is None else Entry(self, **metadata)
+            for domain_and_path, metadata in self._manifest_db.get_metadata_by_domains_and_paths(
+                domains_and_paths).items()
+        }
+
+    def get_domains(self):
+        """
+        Get the names of all domains in backup.
+        :return: Sorted list of domains, e.g. ['AppDomain-com.whatsapp', 'HomeDomain'].
+        :rtype: list
+        """
+        return self._manifest_db.get_domains()
+
+    def iter_entries(self, lazy: bool = False, domain: Optional[str] = None, domain_prefix: Optional[str] = None,
+                     path_glob: Optional[str] = None, kind: Optional[EntryKind] = None):
         """
         Iter over all entries in backup.
+        Filters are applied by the Manifest.db itself, so filtered out entries are never decoded.
+        :param lazy: Decode entries metadata only when first accessed, making scans that only look at entries domains
+        and paths much cheaper.
+        :param domain: Only iter entries of this domain, e.g. 'RootDomain'.
+        :param domain_prefix: Only iter entries of domains starting with this prefix, e.g. 'AppDomain-com.whatsapp'.
+        :param path_glob: Only iter entries whose relative path matches this glob, where `*` also matches `/`.
+        :param kind: Only iter entries of this kind, e.g. EntryKind.DIRECTORY or 'dir'.
         """
-        for metadata in self._manifest_db.get_all_entries():
-            yield Entry(self, **metadata)
+        entries = self._manifest_db.get_all_entries(lazy=lazy, domain=domain, domain_prefix=domain_prefix,
+                                                    path_glob=path_glob, kind=kind)
+        for metadata in entries:
+            yield self._lazy_entry(metadata) if lazy else Entry(self, **metadata)
 
-    def iter_files(self):
+    def iter_files(self, lazy: bool = False, domain: Optional[str] = None, domain_prefix: Optional[str] = None,
+                   path_glob: Optional[str] = None):
         """
         Iter over all files in backup.
+        :param lazy: Decode entries metadata only when first accessed.
+        :param domain: Only iter files of this domain, e.g. 'RootDomain'.
+        :param domain_prefix: Only iter files of domains starting with this prefix, e.g. 'AppDomain-com.whatsapp'.
+        :param path_glob: Only iter files whose relative path matches this glob, where `*` also matches `/`.
         """
-        return filter(lambda f: f.is_file(), self.iter_entries())
+        return self.iter_entries(lazy, domain, domain_prefix, path_glob, EntryKind.FILE)
+
+    def iter_children(self, domain: Optional[str], relative_path: str):
+        """
+        Iter over the direct children of a directory.
+        Children are indexed on first use, so listing further directories doesn't rescan the backup.
+        :param domain: Directory's domain, None to list the contents of this path in all domains.
+        :param relative_path: Directory's relative path, e.g. 'Library/Preferences'.
+        """
+        parent = relative_path.rstrip('/')
+        if domain is not None:
+            return iter(self._get_children_index(domain).get(parent, ()))
+        return itertools.chain.from_iterable(
+            children.get(parent, ()) for children in self._get_all_children_indexes().values()
+        )
+
+    def walk(self, domain: str, relative_path: str = ''):
+        """
+        Walk a domain's directory tree top-down, like `os.walk`.
+        :param domain: Domain to walk, e.g. 'AppDomain-com.whatsapp'.
+        :param relative_path: Directory to start from, the domain's root by default.
+        :return: Generator of (directory relative path, directories entries, other entries) tuples. Directories
+        removed from the list are not walked into.
+        """
+        children_index = self._get_children_index(domain)
+        stack = [relative_path.rstrip('/')]
+        while stack:
+            path = stack.pop()
+            dirs = []
+            files = []
+            for entry in children_index.get(path, ()):
+                (dirs if entry.is_dir() else files).append(entry)
+            yield path, dirs, files
+            stack.extend(entry.relative_path.rstrip('/') for entry in reversed(dirs))
+
+    def diff(self, other: 'Backup'):
+        """
+        Compare the entries of this backup to the entries of another one, e.g. a later backup of the same device.
+        Only the manifests are compared, by walking both in (domain, relative path) order side by side, so files are
+        never read and memory use doesn't grow with the manifests sizes.
+        :param other: Backup to compare to.
+        :return: Generator of (change, entry of this backup, entry of the other backup) tuples. Change is 'added' for
+        entries only in the other backup, 'removed' for entries only in this backup and 'modified' for entries with
+        different metadata. Missing entries are None.
+        """
+        entries = self._manifest_db.get_sorted_entries()
+        other_entries = other._manifest_db.get_sorted_entries()
+        entry = next(entries, None)
+        other_entry = next(other_entries, None)
+        while entry is not None or other_entry is not None:
+            key = None if entry is None else (entry['domain'], entry['relative_path'])
+            other_key = None if other_entry is None else (other_entry['domain'], other_entry['relative_path'])
+            if other_key is None or (key is not None and key < other_key):
+                yield 'removed', self._lazy_entry(entry), None
+                entry = next(entries, None)
+            elif key is None or other_key < key:
+                yield 'added', None, other._lazy_entry(other_entry)
+                other_entry = next(other_entries, None)
+            else:
+                if entry['raw_metadata'] != other_entry['raw_metadata']:
+                    old = self._lazy_entry(entry)
+                    new = other._lazy_entry(other_entry)
+                    if any(getattr(old, field) != getattr(new, field) for field in DIFF_FIELDS):
+                        yield 'modified', old, new
+                entry = next(entries, None)
+                other_entry = next(other_entries, None)
+
+    def search(self, pattern, domains=None, max_size: Optional[int] = None, skip_suffixes=MEDIA_SUFFIXES,
+               workers: int = 1, strict: bool = False):
+        """
+        Search the decrypted content of all files in backup, without extracting them.
+        Files are skipped by their size and suffix before being decrypted, and searched in chunks. Matches longer than
+        `search.SEARCH_OVERLAP` may be missed when spanning two chunks.
+        :param pattern: Regular expression, either str (matched as UTF-8) or bytes, e.g. rb'token=[0-9a-f]{32}'.
+        :param domains: Only search files of these domains, e.g. ['HomeDomain'].
+        :param max_size: Skip files larger than this size.
+        :param skip_suffixes: Skip files with these suffixes, case insensitive. Media files are skipped by default.
+        :param workers: Number of files decrypted and searched concurrently.
+        :param strict: Raise exception on corrupted or missing entries, instead of skipping them.
+        :return: Generator of (entry, match offset) tuples, yielded as files are searched.
+        """
+        regex = compile_pattern(pattern)
+        skip_suffixes = tuple(suffix.lower() for suffix in skip_suffixes)
+        if domains is None:
+            entries = self.iter_files(lazy=True)
+        else:
+            entries = itertools.chain.from_iterable(self.iter_files(lazy=True, domain=domain) for domain in domains)
+        # Suffixes are checked first, as they are known without loading the metadata of lazy entries.
+        entries = (
+            entry for entry in entries
+            if not (skip_suffixes and entry.relative_path.lower().endswith(skip_suffixes))
+            and not (max_size is not None and entry.size > max_size)
+        )
+        for entry, offsets in _map_bounded(lambda entry: self._search_entry(entry, regex, strict), entries, workers):
+            for offset in offsets:
+                yield entry, offset
+
+    def verify(self, workers: int = 1):
+        """
+        Verify the data of all files in backup, without extracting them.
+        Every file is checked to exist, to have a stored size matching its entry's size and to have valid padding.
+        Files with a digest, only recorded by Manifest.mbdb, are also decrypted and hashed.
+        :param workers: Number of files verified concurrently.
+        :return: Number of checked files and the problems found, sorted by domain and relative path, each with the
+        entry's ID, domain, relative path, problem and details, e.g.
+        {'checked': 2, 'problems': [{'file_id': '...', 'domain': 'HomeDomain', 'relative_path': 'a.txt',
+        'problem': 'missing', 'detail': '...'}]}.
+        :rtype: dict
+        """
+        checked = 0
+        problems = []
+
+        def record(entry, result):
+            nonlocal checked
+            checked += 1
+            if result is not None:
+                problem, detail = result
+                logger.warning(f'{entry.domain} {entry.relative_path}: {detail}')
+                problems.append(problem_report(entry.file_id, entry.domain, entry.relative_path, problem, detail))
+
+        for entry, result in _map_bounded(verify_entry, self.iter_files(), workers):
+            record(entry, result)
+        problems.sort(key=lambda problem: (problem['domain'], problem['relative_path']))
+        return {'checked': checked, 'problems': problems}
+
+    def quick_check(self):
+        """
+        Check the structure of the backup without decrypting anything, only looking at stored files sizes.
+        Stored files are listed by a single sweep of the backup directory, and matched against the manifest to find
+        missing files, files whose size doesn't match their entry's size, and stored files without an entry.
+        :return: Number of checked files and the problems found, in the format of `verify`. Stored files without an
+        entry come last, with their domain and relative path set to None.
+        :rtype: dict
+        """
+        stored_sizes = scan_stored_files(self.path, self.ios_version > HASH_DIRECTORIES_MIN_VERSION)
+        checked = 0
+        problems = []
+        for entry in self.iter_files():
+            checked += 1
+            stored_size = stored_sizes.pop(entry.file_id, None)
+            if stored_size is None:
+                result = Problem.MISSING, f'{entry.hash_path} does not exist'
+            else:
+                result = check_stored_size(entry, stored_size)
+            if result is not None:
+                problem, detail = result
+                logger.warning(f'{entry.domain} {entry.relative_path}: {detail}')
+                problems.append(problem_report(entry.file_id, entry.domain, entry.relative_path, problem, detail))
+        problems.sort(key=lambda problem: (problem['domain'], problem['relative_path']))
+        for file_id in sorted(stored_sizes):
+            logger.warning(f'{file_id} has no entry')
+            problems.append(problem_report(file_id, None, None, Problem.ORPHANED, 'stored file has no entry'))
+        return {'checked': checked, 'problems': problems}
 
     def stats(self):
         """
@@ -224,10 +564,184 @@ class Backup:
             'is_encrypted': self._manifest_plist.is_encrypted,
         }
 
-    def _extract_and_write_entry_content(self, entry: Entry, dest: Path, strict: bool):
+    def _iter_export_entries(self, strict: bool):
+        """
+        Iter over all entries to export, opening the data of files.
+        :param strict: Raise exception on corrupted entries, instead of skipping them.
+        :return: Generator of (entry, archive path, opened data) tuples, the data is None for entries that aren't files.
+        """
+        for entry in self.iter_entries():
+            name = posixpath.join(entry.domain, entry.relative_path).rstrip('/')
+            if not entry.is_file():
+                yield entry, name, None
+                continue
+            try:
+                data = entry.open()
+            except ValueError:
+                logger.warning(f'Could not export content for {entry.relative_path}')
+                if strict:
+                    raise CorruptedEntryError()
+                continue
+            with data:
+                yield entry, name, data
+
+    @staticmethod
+    def _search_entry(entry: Entry, regex, strict: bool):
+        """
+        Search the decrypted content of an entry.
+        :return: Offsets of all matches, none if the entry is corrupted or missing and strict is not set.
+        """
+        try:
+            with entry.open() as data:
+                return list(search_file(data, regex))
+        except FileNotFoundError:
+            # Partial backups often lack some of their stored files.
+            logger.warning(f'Could not find stored file of {entry.relative_path}')
+            if strict:
+                raise
+            return []
+        except ValueError:
+            logger.warning(f'Could not search content for {entry.relative_path}')
+            if strict:
+                raise CorruptedEntryError()
+            return []
+
+    def _lazy_entry(self, metadata) -> LazyEntry:
+        return LazyEntry(self, metadata.get('file_id'), metadata['domain'], metadata['relative_path'],
+                         metadata['load_metadata'])
+
+    def _get_children_index(self, domain: str):
+        if domain not in self._children_index and not self._children_index_complete:
+            self._children_index.update(self._index_children(self.iter_entries(lazy=True, domain=domain)))
+            self._children_index.setdefault(domain, {})
+        return self._children_index.get(domain, {})
+
+    def _get_all_children_indexes(self):
+        if not self._children_index_complete:
+            self._children_index = self._index_children(self.iter_entries(lazy=True))
+            self._children_index_complete = True
+        return self._children_index
+
+    @staticmethod
+    def _index_children(entries):
+        index = {}
+        for entry in entries:
+            path = entry.relative_path.rstrip('/')
+            if not path:
+                # Domains roots are not children of any directory.
+                continue
+            index.setdefault(entry.domain, {}).setdefault(posixpath.dirname(path), []).append(entry)
+        return index
+
+    def _extract_entries(self, entries_and_destinations, strict: bool, workers: int, journal_dir: Path = None,
+                         store: Optional[ContentStore] = None):
+        """
+        Extract entries to their destinations, using a thread pool when more than one worker is requested.
+        At most a bounded number of entries is in flight, and extraction stops on the first raised error.
+        :param entries_and_destinations: Iterable of entries and the paths to extract them to.
+        :param strict: Raise exception on extracting errors.
+        :param workers: Number of files to extract in parallel.
+        :param journal_dir: Directory of the extraction journal to resume from and record to, None to extract all
+        entries without a journal.
+        :param store: Content store to write files data to, None to write files directly.
+        """
+        if journal_dir is None:
+            self._run_extraction(entries_and_destinations, strict, workers, None, store)
+            return
+        with ExtractionJournal.from_directory(journal_dir) as journal:
+            self._run_extraction(
+                ((entry, dest) for entry, dest in entries_and_destinations if not self._is_extracted(journal, entry, dest)),
+                strict, workers, journal, store
+            )
+
+    def _iter_changed_entries(self, journal: ExtractionJournal, dest_dir: Path, report, file_ids):
+        """
+        Iter over files that changed since they were recorded in an extraction journal.
+        :param journal: Journal of the extraction directory.
+        :param dest_dir: Extraction directory, in an `unback` layout.
+        :param dict report: Change report to update.
+        :param set file_ids: Set to add the IDs of all files in the backup to.
+        :return: Generator of changed entries and the paths to extract them to.
+        """
+        for entry in self.iter_files():
+            file_ids.add(entry.file_id)
+            dest = dest_dir / entry.domain / entry.relative_path
+            if journal.is_extracted(entry, dest):
+                report['unchanged'] += 1
+                continue
+            report['modified' if journal.is_recorded(entry.file_id) else 'added'].append(
+                (entry.domain, entry.relative_path))
+            yield entry, dest
+
+    @staticmethod
+    def _is_extracted(journal: ExtractionJournal, entry: Entry, dest: Path) -> bool:
+        if journal.is_extracted(entry, dest):
+            logger.debug(f'Skipping already extracted file {entry.filename}')
+            return True
+        return False
+
+    def _run_extraction(self, entries_and_destinations, strict: bool, workers: int,
+                        journal: Optional[ExtractionJournal], store: Optional[ContentStore] = None):
+        extractions = _map_bounded(lambda item: self._extract_entry(*item, strict, journal, store),
+                                   entries_and_destinations, workers)
+        for _ in extractions:
+            pass
+
+    def _extract_entry(self, entry: Entry, dest: Path, strict: bool, journal: Optional[ExtractionJournal] = None,
+                       store: Optional[ContentStore] = None):
+        logger.debug(f'Extracting file {entry.filename} to {dest}')
+        dest.parent.mkdir(exist_ok=True, parents=True)
+        if self._extract_and_write_entry_content(entry, dest, strict, store) and journal is not None:
+            journal.add(entry, dest)
+
+    def _extract_and_write_entry_content(self, entry: Entry, dest: Path, strict: bool,
+                                         store: Optional[ContentStore] = None) -> bool:
+        """
+        Write the decrypted content of an entry.
+        :return: Whether the content was written, False if it is corrupted and strict is not set.
+        """
         try:
-            dest.write_bytes(entry.read_bytes())
+            if store is not None:
+                store.link(entry, dest)
+            else:
+                entry.save(dest)
         except ValueError:
             logger.warning(f'Could not extract content for {entry.relative_path}')
             if strict:
                 raise CorruptedEntryError()
+            return False
+        return True
+
+
+def _map_bounded(func, items, workers: int):
+    """
+    Apply a function to items concurrently, submitting only a few items per worker ahead of the results, so lazy
+    iterables are not consumed all at once.
+    :param func: Function to apply to each item.
+    :param items: Iterable of items.
+    :param workers: Number of concurrent calls, items are processed in order by the calling thread when lower than 2.
+    :return: Generator of (item, result) tuples, in completion order.
+    """
+    if workers <= 1:
+        return ((item, func(item)) for item in items)
+    return _map_concurrently(func, items, workers)
+
+
+def _map_concurrently(func, items, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        try:
+            for item in items:
+                if len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield in_flight.pop(future), future.result()
+                in_flight[executor.submit(func, item)] = item
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('pyiosbackup')
+
+OBJECT_MODE = 0o444
+
+
+class HashingWriter:
+    def __init__(self, file=None, algorithm: str = 'sha256'):
+        """
+        Wrap a binary file object, hashing all data written through it.
+        :param file: Binary file object to write to, None to only hash the data.
+        :param algorithm: Name of the hashlib algorithm to use.
+        """
+        self._file = file
+        self.hash = hashlib.new(algorithm)
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        return len(data) if self._file is None else self._file.write(data)
+
+
+class ContentStore:
+    INDEX_NAME = 'index.sqlite3'
+    INDEX_VERSION = 1
+
+    def __init__(self, path):
+        """
+        Create a content-addressed store of decrypted entries data, shared between extractions of many backups.
+        Data is stored once per SHA-256 digest of its content, and extracted files are hard links to the stored objects.
+        Stored objects are read-only, since modifying an extracted file would modify every file linked to it.
+        :param path: Path to store directory.
+        """
+        self.path = Path(path)
+        self._objects_path = self.path / 'objects'
+        self._temp_path = self.path / 'tmp'
+        self._objects_path.mkdir(parents=True, exist_ok=True)
+        self._temp_path.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path / self.INDEX_NAME), check_same_thread=False, timeout=60)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        with self._conn:
+            if self._conn.execute('PRAGMA user_version').fetchone()[0] < self.INDEX_VERSION:
+                # Older indexes didn't tell apart entries of different devices, their entries are stored again.
+                self._conn.execute('DROP TABLE IF EXISTS entries')
+                self._conn.execute(f'PRAGMA user_version = {self.INDEX_VERSION}')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS entries (source TEXT, file_id TEXT, size INTEGER, '
+                               'last_modified REAL, digest TEXT, PRIMARY KEY (source, file_id, size, last_modified))')
+
+    def add(self, entry) -> Path:
+        """
+        Store the decrypted data of an entry.
+        Entries already stored, by their device, ID, size and modification time, are neither decrypted nor hashed
+        again.
+        :param entry: Entry to store.
+        :return: Path to the stored object.
+        """
+        key = (_entry_source(entry), entry.file_id, entry.size, entry.last_modified.timestamp())
+        with self._lock:
+            row = self._conn.execute('SELECT digest FROM entries WHERE source = ? AND file_id = ? AND size = ? AND '
+                                     'last_modified = ?', key).fetchone()
+        if row is not None:
+            object_path = self._object_path(row[0])
+            if object_path.exists():
+                return object_path
+        fd, temp_path = tempfile.mkstemp(dir=self._temp_path)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                writer = HashingWriter(temp_file)
+                entry.write_to(writer)
+            digest = writer.hash.hexdigest()
+            object_path = self._object_path(digest)
+            if object_path.exists():
+                logger.debug(f'Content of {entry.relative_path} is already stored as {digest}')
+                os.unlink(temp_path)
+            else:
+                object_path.parent.mkdir(exist_ok=True)
+                os.chmod(temp_path, OBJECT_MODE)
+                os.replace(temp_path, object_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (*key, digest))
+        return object_path
+
+    def link(self, entry, dest: Path):
+        """
+        Store the decrypted data of an entry, and link a destination path to it.
+        Destinations on other filesystems than the store get a copy instead.
+        :param entry: Entry to store.
+        :param dest: Path to link.
+        """
+        object_path = self.add(entry)
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+        try:
+            os.link(object_path, dest)
+        except OSError:
+            logger.debug(f'Could not link {dest} to the store, copying it instead')
+            shutil.copyfile(object_path, dest)
+
+    def close(self):
+        """
+        Close the store index.
+        """
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _object_path(self, digest: str) -> Path:
+        return self._objects_path / digest[:2] / digest
+
+
+def _entry_source(entry) -> str:
+    """
+    Identify where an entry's data came from, since entries IDs are the same for the same path on every device.
+    :param entry: Entry to identify.
+    :return: The entry's wrapped key for encrypted backups, as those are random per file, otherwise the device
+    identifier.
+    """
+    if entry.backup.is_encrypted:
+        return entry.encryption_key.hex()
+    return entry.backup.target_identifier
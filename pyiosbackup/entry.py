@@ -1,16 +1,44 @@
+import io
+import os
 import pathlib
-import posixpath
-from dataclasses import dataclass
+import shutil
+from dataclasses import dataclass, fields
 from datetime import datetime
+from enum import Enum
+from typing import Optional
 
-from cryptography.hazmat.primitives import padding
 from packaging.version import Version
 
-FILE_DATA_PAD_BITS = 128  # Files data is 128 bits (16 bytes) padded.
+from pyiosbackup.entry_file import DecryptedEntryFile, decrypt_entry_data, decrypt_entry_to_file
+
 MODE_TYPE_MASK = 0xE000
 MODE_TYPE_SYMLINK = 0xA000
 MODE_TYPE_FILE = 0x8000
 MODE_TYPE_DIR = 0x4000
+# Starting from this version, entries files are kept in directories named by their IDs first byte.
+HASH_DIRECTORIES_MIN_VERSION = Version('10.2')
+
+
+class EntryKind(Enum):
+    FILE = 'file'
+    DIRECTORY = 'dir'
+    SYMLINK = 'symlink'
+
+    @staticmethod
+    def from_mode(mode: int) -> Optional['EntryKind']:
+        """
+        Get the kind of an entry from its mode.
+        :param mode: Entry's mode.
+        :return: Entry kind, None for other types.
+        """
+        return MODE_TYPES_KINDS.get(mode & MODE_TYPE_MASK)
+
+
+MODE_TYPES_KINDS = {
+    MODE_TYPE_FILE: EntryKind.FILE,
+    MODE_TYPE_DIR: EntryKind.DIRECTORY,
+    MODE_TYPE_SYMLINK: EntryKind.SYMLINK,
+}
 
 
 @dataclass
@@ -27,6 +55,9 @@ class Entry:
     group_id: int
     user_id: int
     encryption_key: bytes
+    link_target: str = ''
+    # SHA-1 digest of the entry data, only recorded by Manifest.mbdb.
+    digest: bytes = b''
 
     @property
     def name(self) -> str:
@@ -87,7 +118,7 @@ class Entry:
         """
         Relative path of the entry file (from the backup directory).
         """
-        if self.backup.ios_version > Version('10.2'):
+        if self.backup.ios_version > HASH_DIRECTORIES_MIN_VERSION:
             return pathlib.Path(self.file_id[:2]) / self.file_id
         else:
             return pathlib.Path(self.file_id)
@@ -111,13 +142,57 @@ class Entry:
         """
         Read decrypted entry data.
         """
-        encrypted = self.read_raw()
+        data = self.read_raw()
+        if not self.backup.is_encrypted:
+            return data
+        return decrypt_entry_data(data, self.backup.keybag.unwrap_key(self.encryption_key))
+
+    def open(self):
+        """
+        Open the entry for reading its decrypted data.
+        Data is decrypted in fixed-size chunks, so memory usage does not depend on the entry size. The returned file
+        is seekable, and reading from an arbitrary offset only decrypts the blocks covering the requested range.
+        :return: Read-only, seekable binary file object.
+        """
+        if not self.backup.is_encrypted:
+            return self.real_path.open('rb')
+        key = self.backup.keybag.unwrap_key(self.encryption_key)
+        return io.BufferedReader(DecryptedEntryFile(self.real_path, key))
+
+    def save(self, path):
+        """
+        Save the decrypted entry data to a file.
+        Encrypted data is decrypted in chunks through reused buffers, and unencrypted data is copied by the kernel
+        where the platform supports it.
+        Data is written to a temporary file next to the destination, which replaces the destination only once all
+        of it is written. Existing destinations are left as they are when the entry is missing or corrupted, and hard
+        links to them are never modified.
+        :param path: Destination path.
+        """
+        path = pathlib.Path(path)
+        temp_path = path.with_name(f'.{path.name}.{os.getpid()}')
+        try:
+            if self.backup.is_encrypted:
+                with open(temp_path, 'wb') as dest_file:
+                    self.write_to(dest_file)
+            else:
+                shutil.copyfile(self.real_path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+    def write_to(self, file):
+        """
+        Write the decrypted entry data to a file object.
+        :param file: Binary file object to write to.
+        """
         if not self.backup.is_encrypted:
-            return encrypted
-        decrypted = self.backup.keybag.decrypt(encrypted, self.encryption_key)
-        unpadder = padding.PKCS7(FILE_DATA_PAD_BITS).unpadder()
-        decrypted = unpadder.update(decrypted) + unpadder.finalize()
-        return decrypted
+            with self.real_path.open('rb') as source:
+                shutil.copyfileobj(source, file)
+            return
+        decrypt_entry_to_file(self.real_path, self.backup.keybag.unwrap_key(self.encryption_key), file)
 
     def is_dir(self) -> bool:
         """
@@ -131,6 +206,12 @@ class Entry:
         """
         return self.mode & MODE_TYPE_MASK == MODE_TYPE_FILE
 
+    def is_symlink(self) -> bool:
+        """
+        Check if entry is a symbolic link.
+        """
+        return self.mode & MODE_TYPE_MASK == MODE_TYPE_SYMLINK
+
     def iterdir(self, enforce_domain: bool = True):
         """
         When the entry points to a directory, yield path objects of the directory contents.
@@ -138,17 +219,60 @@ class Entry:
         """
         if not self.is_dir():
             raise ValueError('Can\'t listdir a file')
-        for entry in self.backup.iter_entries():
-            if enforce_domain and entry.domain != self.domain:
-                continue
-            if entry.relative_path == self.relative_path:
-                continue
-            if posixpath.dirname(entry.relative_path.rstrip('/')) != self.relative_path.rstrip('/'):
-                continue
-            yield entry
+        yield from self.backup.iter_children(self.domain if enforce_domain else None, self.relative_path)
 
     def __str__(self):
         return str(self.filename)
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.root}, {self.relative_path}, {self.domain})'
+
+
+LAZY_FIELDS = frozenset(field.name for field in fields(Entry)) - {'backup', 'file_id', 'domain', 'relative_path'}
+
+
+class LazyField:
+    def __init__(self, name: str):
+        """
+        Load an entry field on access, for fields with defaults.
+        Such fields are class attributes of `Entry`, so looking them up on a lazy entry never reaches its
+        `__getattr__`. Once the metadata is loaded, the instance attribute takes precedence over this descriptor.
+        :param name: Field name.
+        """
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__getattr__(self.name)
+
+
+class LazyEntry(Entry):
+    def __init__(self, backup, file_id: Optional[str], domain: str, relative_path: str, load_metadata):
+        """
+        Create an entry whose metadata is only loaded when one of its fields is first accessed.
+        :param backup: Backup the entry belongs to.
+        :param file_id: Entry's ID, None to load it along with the metadata.
+        :param domain: Entry's domain.
+        :param relative_path: Entry's relative path.
+        :param load_metadata: Callable returning the rest of the entry fields.
+        """
+        self.backup = backup
+        if file_id is not None:
+            self.file_id = file_id
+        self.domain = domain
+        self.relative_path = relative_path
+        self._load_metadata = load_metadata
+
+    def __getattr__(self, name):
+        # Only called for attributes missing from the instance, i.e. before the metadata is loaded.
+        if (name not in LAZY_FIELDS and name != 'file_id') or self.__dict__.get('_load_metadata') is None:
+            raise AttributeError(f'{self.__class__.__name__!r} object has no attribute {name!r}')
+        self.__dict__.update(self._load_metadata())
+        self._load_metadata = None
+        return self.__dict__[name]
+
+
+for _name in LAZY_FIELDS:
+    if hasattr(Entry, _name):
+        setattr(LazyEntry, _name, LazyField(_name))
@@ -0,0 +1,195 @@
+import io
+import os
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+FILE_DATA_PAD_BITS = 128  # Files data is 128 bits (16 bytes) padded.
+BLOCK_SIZE = FILE_DATA_PAD_BITS // 8
+CHUNK_SIZE = 1024 * 1024
+ZERO_IV = b'\x00' * BLOCK_SIZE
+
+
+def decrypt_entry_data(data: bytes, key: bytes) -> bytes:
+    """
+    Decrypt a whole AES-CBC encrypted entry at once, cheaper than a file object for small entries.
+    :param data: Encrypted entry data.
+    :param key: Unwrapped AES key of the entry.
+    :return: Decrypted data, without padding.
+    """
+    if len(data) % BLOCK_SIZE:
+        raise ValueError('Encrypted data is not aligned to the cipher block size')
+    if not data:
+        return b''
+    decrypted = Cipher(algorithms.AES(key), modes.CBC(ZERO_IV)).decryptor().update(data)
+    return decrypted[:len(decrypted) - padding_length(decrypted[-BLOCK_SIZE:])]
+
+
+def decrypt_entry_to_file(path, key: bytes, dest_file, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Decrypt an AES-CBC encrypted entry into a file.
+    Every chunk is read and decrypted into the same pair of buffers, so no per-chunk objects are allocated.
+    :param path: Path to the encrypted entry file.
+    :param key: Unwrapped AES key of the entry.
+    :param dest_file: Binary file object to write the decrypted data to.
+    :param chunk_size: Maximal amount of ciphertext to decrypt at once, rounded down to a block boundary.
+    :return: Size of the decrypted data.
+    """
+    with open(path, 'rb') as file:
+        encrypted_size = os.fstat(file.fileno()).st_size
+        size = plaintext_size(file, encrypted_size, key)
+        if not size:
+            return 0
+        file.seek(0)
+        chunk_size = min(max(chunk_size - chunk_size % BLOCK_SIZE, BLOCK_SIZE), encrypted_size)
+        encrypted = memoryview(bytearray(chunk_size))
+        # `update_into` requires room for an extra block, even though CBC never outputs more than its input.
+        decrypted = memoryview(bytearray(chunk_size + BLOCK_SIZE - 1))
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(ZERO_IV)).decryptor()
+        remaining = size
+        while remaining > 0:
+            read = file.readinto(encrypted)
+            if not read or read % BLOCK_SIZE:
+                raise ValueError('Encrypted data is truncated')
+            decrypted_size = decryptor.update_into(encrypted[:read], decrypted)
+            dest_file.write(decrypted[:min(decrypted_size, remaining)])
+            remaining -= decrypted_size
+    return size
+
+
+def plaintext_size(file, encrypted_size: int, key: bytes) -> int:
+    """
+    Calculate the decrypted data size of an entry from the padding of its last block.
+    :param file: Encrypted entry file, left positioned at its end.
+    :param encrypted_size: Size of the encrypted entry file.
+    :param key: Unwrapped AES key of the entry.
+    :return: Decrypted data size.
+    """
+    if encrypted_size % BLOCK_SIZE:
+        raise ValueError('Encrypted data is not aligned to the cipher block size')
+    if not encrypted_size:
+        return 0
+    if encrypted_size == BLOCK_SIZE:
+        iv = ZERO_IV
+        file.seek(0)
+    else:
+        file.seek(encrypted_size - 2 * BLOCK_SIZE)
+        iv = file.read(BLOCK_SIZE)
+    last_block = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor().update(file.read(BLOCK_SIZE))
+    return encrypted_size - padding_length(last_block)
+
+
+def padding_length(last_block: bytes) -> int:
+    """
+    Get the length of the PKCS7 padding of decrypted data.
+    :param last_block: Last decrypted block.
+    :return: Padding length.
+    """
+    length = last_block[-1]
+    if not 0 < length <= BLOCK_SIZE or not last_block.endswith(bytes([length]) * length):
+        raise ValueError('Invalid padding bytes.')
+    return length
+
+
+class DecryptedEntryFile(io.RawIOBase):
+    def __init__(self, path, key: bytes, chunk_size: int = CHUNK_SIZE):
+        """
+        Create a read-only, seekable file object that decrypts an AES-CBC encrypted entry in fixed-size chunks.
+        Since every CBC block only depends on the previous ciphertext block, reading from an arbitrary offset only
+        decrypts the blocks covering the requested range.
+        :param path: Path to the encrypted entry file.
+        :param key: Unwrapped AES key of the entry.
+        :param chunk_size: Maximal amount of ciphertext to decrypt at once, rounded down to a block boundary.
+        """
+        super().__init__()
+        self._key = key
+        self._chunk_size = max(chunk_size - chunk_size % BLOCK_SIZE, BLOCK_SIZE)
+        self._position = 0
+        # Decrypted chunk, starting at a block aligned plaintext offset.
+        self._chunk = b''
+        self._chunk_start = 0
+        # Decryptor continuing from the block right after the current chunk, for sequential reads.
+        self._decryptor = None
+        self._next_block = 0
+        self._file = open(path, 'rb')
+        try:
+            self._encrypted_size = os.fstat(self._file.fileno()).st_size
+            self._size = plaintext_size(self._file, self._encrypted_size, key)
+        except ValueError:
+            self._file.close()
+            raise
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the decrypted data.
+        """
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._size:
+            return 0
+        if not self._chunk_start <= self._position < self._chunk_start + len(self._chunk):
+            self._decrypt_chunk(self._position // BLOCK_SIZE)
+        offset = self._position - self._chunk_start
+        size = min(len(buffer), len(self._chunk) - offset, self._size - self._position)
+        buffer[:size] = self._chunk[offset:offset + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+    def _create_decryptor(self, block_index: int):
+        """
+        Create a decryptor starting at a given block and position the encrypted file on that block.
+        :param block_index: Index of the first block to decrypt.
+        :return: AES-CBC decryptor.
+        """
+        if block_index == 0:
+            iv = ZERO_IV
+            self._file.seek(0)
+        else:
+            self._file.seek((block_index - 1) * BLOCK_SIZE)
+            iv = self._file.read(BLOCK_SIZE)
+        self._next_block = block_index
+        return Cipher(algorithms.AES(self._key), modes.CBC(iv)).decryptor()
+
+    def _decrypt_chunk(self, block_index: int):
+        """
+        Decrypt a chunk of data starting at a given block.
+        :param block_index: Index of the first block to decrypt.
+        """
+        if self._decryptor is None or self._next_block != block_index:
+            self._decryptor = self._create_decryptor(block_index)
+        offset = block_index * BLOCK_SIZE
+        encrypted = self._file.read(min(self._chunk_size, self._encrypted_size - offset))
+        if not encrypted or len(encrypted) % BLOCK_SIZE:
+            raise ValueError('Encrypted data is truncated')
+        self._chunk = self._decryptor.update(encrypted)
+        self._chunk_start = offset
+        self._next_block = block_index + len(encrypted) // BLOCK_SIZE
@@ -0,0 +1,115 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('pyiosbackup')
+
+
+class ExtractionJournal:
+    NAME = '.pyiosbackup-journal.sqlite3'
+
+    def __init__(self, path: Path, conn: sqlite3.Connection):
+        """
+        Create a journal of entries extracted to a directory.
+        Extraction workers record entries from several threads, so every access is serialized by a lock.
+        :param path: Path to extraction directory.
+        :param conn: Connection to the journal database.
+        """
+        self.path = path
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_directory(path):
+        """
+        Open the journal of an extraction directory, creating it if needed.
+        :param path: Path to extraction directory.
+        :return: ExtractionJournal object.
+        :rtype: ExtractionJournal
+        """
+        path = Path(path)
+        journal_path = path / ExtractionJournal.NAME
+        logger.debug(f'Using extraction journal {journal_path}')
+        conn = sqlite3.connect(str(journal_path), check_same_thread=False)
+        # A crash may lose the last few records, which only means extracting their entries again.
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries (file_id TEXT PRIMARY KEY, domain TEXT, '
+                         'relative_path TEXT, size INTEGER, last_modified REAL, dest TEXT, dest_size INTEGER, '
+                         'dest_mtime_ns INTEGER)')
+        return ExtractionJournal(path, conn)
+
+    def is_extracted(self, entry, dest: Path) -> bool:
+        """
+        Check if an entry was already extracted, and its extracted file was not changed since.
+        :param entry: Entry to check.
+        :param dest: Path the entry is extracted to, inside the extraction directory.
+        """
+        with self._lock:
+            record = self._conn.execute(
+                'SELECT size, last_modified, dest, dest_size, dest_mtime_ns FROM entries WHERE file_id = ?',
+                (entry.file_id,)
+            ).fetchone()
+        if record is None or record[:3] != (entry.size, entry.last_modified.timestamp(), self._relative_dest(dest)):
+            return False
+        try:
+            stat = dest.stat()
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == record[3:]
+
+    def add(self, entry, dest: Path):
+        """
+        Record an extracted entry.
+        :param entry: Extracted entry.
+        :param dest: Path the entry was extracted to, inside the extraction directory.
+        """
+        stat = dest.stat()
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                entry.file_id, entry.domain, entry.relative_path, entry.size, entry.last_modified.timestamp(),
+                self._relative_dest(dest), stat.st_size, stat.st_mtime_ns,
+            ))
+
+    def is_recorded(self, file_id: str) -> bool:
+        """
+        Check if an entry was ever recorded, even if it changed since.
+        :param file_id: Entry's ID.
+        """
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM entries WHERE file_id = ?', (file_id,)).fetchone() is not None
+
+    def iter_records(self):
+        """
+        Iter over all recorded entries.
+        :return: Generator of (file ID, domain, relative path, extracted file path) tuples.
+        """
+        with self._lock:
+            records = self._conn.execute('SELECT file_id, domain, relative_path, dest FROM entries').fetchall()
+        for file_id, domain, relative_path, dest in records:
+            yield file_id, domain, relative_path, self.path / dest
+
+    def remove(self, file_id: str):
+        """
+        Remove an entry's record.
+        :param file_id: Entry's ID.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM entries WHERE file_id = ?', (file_id,))
+
+    def close(self):
+        """
+        Close the journal database.
+        """
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _relative_dest(self, dest: Path) -> str:
+        return dest.relative_to(self.path).as_posix()
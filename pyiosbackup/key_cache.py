@@ -0,0 +1,91 @@
+import logging
+import os
+import stat
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger('pyiosbackup')
+
+CACHE_DIR_MODE = 0o700
+CACHE_FILE_MODE = 0o600
+
+
+class KeyCache:
+    def __init__(self, path, ttl: Optional[float] = None):
+        """
+        Create an on-disk cache of password derived keys.
+        The cache holds key material, so its directory and files are only accessible to the current user.
+        :param path: Path to cache directory.
+        :param ttl: Seconds a cached key stays valid, None to keep keys until cleared.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+
+    def get(self, fingerprint: str) -> Optional[bytes]:
+        """
+        Get a cached key.
+        :param fingerprint: Fingerprint of the key derivation inputs.
+        :return: Cached key, None if the key is not cached or expired.
+        """
+        key_path = self.path / fingerprint
+        try:
+            if self.ttl is not None and time.time() - key_path.stat().st_mtime > self.ttl:
+                logger.debug(f'Cached key {fingerprint} expired')
+                key_path.unlink()
+                return None
+            return key_path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, fingerprint: str, key: bytes):
+        """
+        Cache a key.
+        :param fingerprint: Fingerprint of the key derivation inputs.
+        :param key: Derived key.
+        """
+        make_private_directory(self.path)
+        write_private_file(self.path / fingerprint, key)
+
+    def clear(self):
+        """
+        Remove all cached keys.
+        """
+        if not self.path.is_dir():
+            return
+        for key_path in self.path.iterdir():
+            if key_path.is_file():
+                key_path.unlink()
+
+
+def make_private_directory(path: Path):
+    """
+    Create a directory only accessible to the current user, restricting it if it already exists.
+    :param path: Path to the directory.
+    """
+    path.mkdir(mode=CACHE_DIR_MODE, parents=True, exist_ok=True)
+    if stat.S_IMODE(path.stat().st_mode) & ~CACHE_DIR_MODE:
+        logger.debug(f'Restricting access to {path}')
+        path.chmod(CACHE_DIR_MODE)
+
+
+def write_private_file(path: Path, data: bytes, prepare: Optional[Callable[[Path], None]] = None):
+    """
+    Write a file only accessible to the current user.
+    The data is written to a temporary file first, so readers never see a partially written file.
+    :param path: Path to the file, in a directory created by `make_private_directory`.
+    :param data: Content of the file.
+    :param prepare: Called with the path of the temporary file before it is moved into place.
+    """
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}')
+    try:
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CACHE_FILE_MODE)
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        if prepare is not None:
+            prepare(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
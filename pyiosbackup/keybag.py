@@ -1,20 +1,21 @@
+import functools
 import hashlib
 import logging
 import math
+from typing import Optional
 
-from construct import Bytes, GreedyBytes, GreedyRange, IfThenElse, Int32ub, Int32ul, Struct, this
+from construct import Bytes, GreedyRange, IfThenElse, Int32ub, Struct, this
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.keywrap import aes_key_unwrap
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap, aes_key_unwrap
 from packaging.version import Version
 
+from pyiosbackup.key_cache import KeyCache
 from pyiosbackup.manifest_plist import ManifestPlist
 
 logger = logging.getLogger('pyiosbackup')
 
-encryption_key_struct = Struct(
-    'class_' / Int32ul,
-    'key' / GreedyBytes
-)
+# Maximal number of unwrapped entries keys kept by a keybag, for repeated reads of the same entries.
+UNWRAPPED_KEYS_CACHE_SIZE = 1024
 
 keybag_struct = GreedyRange(Struct(
     'tag' / Bytes(4),
@@ -37,22 +38,36 @@ def aes_decrypt_wrapped(wrapping_key: bytes, key: bytes, encrypted: bytes) -> by
     return decryptor.update(encrypted) + decryptor.finalize()
 
 
+def split_encryption_key(key: bytes):
+    """
+    Split a wrapped key struct.
+    :param key: Wrapped key struct, a little endian 32 bit class followed by the wrapped key.
+    :return: Key class and wrapped key.
+    """
+    return int.from_bytes(key[:4], 'little'), key[4:]
+
+
 class Keybag:
     CLASS_ELEMENTS_COUNT = 5
 
-    def __init__(self, wrapping_keys):
+    def __init__(self, wrapping_keys, unwrapped_keys_cache_size: int = UNWRAPPED_KEYS_CACHE_SIZE):
         """
         Create a keybag instance.
         :param dict wrapping_keys: Mapping between classes and their wrapping keys.
+        :param unwrapped_keys_cache_size: Maximal number of unwrapped entries keys to keep, 0 to disable caching.
         """
         self._wrapping_keys = wrapping_keys
+        if unwrapped_keys_cache_size:
+            self.unwrap_key = functools.lru_cache(maxsize=unwrapped_keys_cache_size)(self.unwrap_key)
 
     @staticmethod
-    def from_manifest(manifest: ManifestPlist, password: str):
+    def from_manifest(manifest: ManifestPlist, password: str, key_cache: Optional[KeyCache] = None):
         """
         Create a keybag object from a Manifest.plist.
         :param manifest: Loaded Manifest.plist file.
         :param password: Password to encrypted backup.
+        :param key_cache: Cache of password derived keys, None to always derive the key. Cached keys are identified by
+        the keybag alone, so the password isn't checked once the key of a keybag is cached.
         :return: Keybag object.
         :rtype: Keybag
         """
@@ -62,14 +77,30 @@ class Keybag:
         class_count = math.ceil((len(keybag) - first_class_index) / Keybag.CLASS_ELEMENTS_COUNT)
         logger.debug(f'Found {class_count} key classes')
         classes_index = len(keybag) - (Keybag.CLASS_ELEMENTS_COUNT * class_count)
-        decryption_key = Keybag._decryption_key_from_password(password, keybag[:classes_index], manifest)
+        root_keys = {key.tag: key.data for key in keybag[:classes_index]}
+        logger.debug(f'Using root elements {root_keys}')
+        classes_data = [keybag[cls_offset:cls_offset + Keybag.CLASS_ELEMENTS_COUNT]
+                        for cls_offset in range(classes_index, len(keybag), Keybag.CLASS_ELEMENTS_COUNT)]
+        double_protected = manifest.product_version > Version('10.2')
+
+        fingerprint = None
+        if key_cache is not None:
+            fingerprint = Keybag._key_fingerprint(root_keys, double_protected)
+            decryption_key = key_cache.get(fingerprint)
+            if decryption_key is not None:
+                try:
+                    # Keys are wrapped with an integrity check, so a cached key is valid if it unwraps them.
+                    classes_keys = Keybag._parse_class_keys(classes_data, decryption_key)
+                    logger.warning(f'Using cached decryption key {fingerprint}, the password is not checked')
+                    return Keybag(classes_keys)
+                except (InvalidUnwrap, ValueError):
+                    logger.debug(f'Cached decryption key {fingerprint} is invalid')
+
+        decryption_key = Keybag._decryption_key_from_password(password, root_keys, double_protected)
         logger.debug(f'Using decryption key {decryption_key.hex()}')
-
-        classes_keys = {}
-        for cls_offset in range(classes_index, len(keybag), Keybag.CLASS_ELEMENTS_COUNT):
-            current_class_data = keybag[cls_offset:cls_offset + Keybag.CLASS_ELEMENTS_COUNT]
-            classes_keys.update(Keybag._parse_class_key(current_class_data, decryption_key))
-
+        classes_keys = Keybag._parse_class_keys(classes_data, decryption_key)
+        if key_cache is not None:
+            key_cache.set(fingerprint, decryption_key)
         return Keybag(classes_keys)
 
     def decrypt(self, data: bytes, key: bytes) -> bytes:
@@ -79,8 +110,17 @@ class Keybag:
         :param key: Wrapped key struct.
         :return: Decrypted data.
         """
-        parsed_key = encryption_key_struct.parse(key)
-        return aes_decrypt_wrapped(self.get_key(parsed_key.class_), parsed_key.key, data)
+        class_, wrapped_key = split_encryption_key(key)
+        return aes_decrypt_wrapped(self.get_key(class_), wrapped_key, data)
+
+    def unwrap_key(self, key: bytes) -> bytes:
+        """
+        Unwrap an entry's encryption key.
+        :param key: Wrapped key struct.
+        :return: AES key to decrypt the entry data with.
+        """
+        class_, wrapped_key = split_encryption_key(key)
+        return aes_key_unwrap(self.get_key(class_), wrapped_key)
 
     def get_key(self, class_) -> bytes:
         """
@@ -91,21 +131,50 @@ class Keybag:
         return self._wrapping_keys[class_]
 
     @staticmethod
-    def _decryption_key_from_password(password: str, root_elements, manifest: ManifestPlist) -> bytes:
+    def _decryption_key_from_password(password: str, root_keys, double_protected: bool) -> bytes:
         """
         Create a decryption key.
         :param password: Password to encrypted backup.
-        :param root_elements: Root elements of keybag.
-        :param manifest: Loaded Manifest.plist file.
+        :param root_keys: Mapping between root elements tags and their data.
+        :param double_protected: Whether the password is derived twice (iOS > 10.2).
         :return: Decryption key.
         """
         password = password.encode('utf-8')
-        root_keys = {key.tag: key.data for key in root_elements}
-        logger.debug(f'Using root elements {root_keys}')
-        if manifest.product_version > Version('10.2'):
+        if double_protected:
             password = hashlib.pbkdf2_hmac('sha256', password, root_keys[b'DPSL'], root_keys[b'DPIC'], 32)
         return hashlib.pbkdf2_hmac('sha1', password, root_keys[b'SALT'], root_keys[b'ITER'], 32)
 
+    @staticmethod
+    def _key_fingerprint(root_keys, double_protected: bool) -> str:
+        """
+        Fingerprint the public key derivation inputs of a keybag, used to identify a derived key in a key cache.
+        The password is left out, so the fingerprint can't be used to check passwords without the key derivation.
+        :param root_keys: Mapping between root elements tags and their data.
+        :param double_protected: Whether the password is derived twice (iOS > 10.2).
+        :return: Hex digest identifying the derived key.
+        """
+        fingerprint = hashlib.sha256()
+        for tag in (b'UUID', b'SALT', b'ITER', b'DPSL', b'DPIC'):
+            data = root_keys.get(tag, b'')
+            data = data.to_bytes(4, 'big') if isinstance(data, int) else data
+            fingerprint.update(tag + len(data).to_bytes(4, 'big') + data)
+        fingerprint.update(bytes([double_protected]))
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def _parse_class_keys(classes_data, decryption_key: bytes):
+        """
+        Parse the keys of all classes.
+        :param classes_data: Elements of every class.
+        :param decryption_key: Decryption key for class keys.
+        :return: Mapping between classes and their decryption keys.
+        :rtype: dict
+        """
+        classes_keys = {}
+        for class_data in classes_data:
+            classes_keys.update(Keybag._parse_class_key(class_data, decryption_key))
+        return classes_keys
+
     @staticmethod
     def _parse_class_key(class_data, decryption_key: bytes):
         """
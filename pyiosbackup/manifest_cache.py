@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+from pyiosbackup.key_cache import make_private_directory, write_private_file
+
+logger = logging.getLogger('pyiosbackup')
+
+CACHE_FILE_SUFFIX = '.sqlite3'
+# Amount of data from each end of the encrypted database hashed into the fingerprint.
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+
+
+class ManifestCache:
+    def __init__(self, path, max_bytes: Optional[int] = None):
+        """
+        Create an on-disk cache of decrypted Manifest.db files.
+        The cache holds decrypted data, so its directory and files are only accessible to the current user.
+        :param path: Path to cache directory.
+        :param max_bytes: Maximal total size of cached databases, least recently used ones are evicted first.
+        None for an unbounded cache.
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def fingerprint(manifest_db_path: Path, manifest_key: bytes) -> str:
+        """
+        Fingerprint an encrypted Manifest.db.
+        The fingerprint covers the database size, modification time, both ends of its content and the ManifestKey,
+        so it can be computed without reading the whole database.
+        :param manifest_db_path: Path to encrypted Manifest.db.
+        :param manifest_key: Wrapped key of the Manifest.db.
+        :return: Hex digest identifying the decrypted database.
+        """
+        fingerprint = hashlib.sha256(manifest_key)
+        with open(manifest_db_path, 'rb') as manifest_db:
+            stat = os.fstat(manifest_db.fileno())
+            fingerprint.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+            fingerprint.update(manifest_db.read(FINGERPRINT_SAMPLE_SIZE))
+            if stat.st_size > FINGERPRINT_SAMPLE_SIZE:
+                manifest_db.seek(max(stat.st_size - FINGERPRINT_SAMPLE_SIZE, FINGERPRINT_SAMPLE_SIZE))
+                fingerprint.update(manifest_db.read())
+        return fingerprint.hexdigest()
+
+    def get(self, fingerprint: str) -> Optional[Path]:
+        """
+        Get a cached database, marking it as recently used.
+        :param fingerprint: Fingerprint of the encrypted Manifest.db.
+        :return: Path to decrypted database, None if it is not cached.
+        """
+        cached_path = self.path / f'{fingerprint}{CACHE_FILE_SUFFIX}'
+        try:
+            os.utime(cached_path)
+        except FileNotFoundError:
+            return None
+        logger.debug(f'Using cached Manifest.db {cached_path}')
+        return cached_path
+
+    def put(self, fingerprint: str, manifest_db: bytes, prepare: Optional[Callable[[Path], None]] = None) -> Path:
+        """
+        Cache a decrypted database.
+        :param fingerprint: Fingerprint of the encrypted Manifest.db.
+        :param manifest_db: Decrypted database.
+        :param prepare: Called with the path of the written copy before it is moved into the cache, e.g. to add
+        indexes. Cached databases may be opened by other processes, so they are never modified afterwards.
+        :return: Path to cached database.
+        """
+        make_private_directory(self.path)
+        cached_path = self.path / f'{fingerprint}{CACHE_FILE_SUFFIX}'
+        write_private_file(cached_path, manifest_db, prepare)
+        logger.debug(f'Cached Manifest.db in {cached_path}')
+        self._evict(keep=cached_path)
+        return cached_path
+
+    def clear(self):
+        """
+        Remove all cached databases.
+        """
+        for cached_path in self._cached_paths():
+            cached_path.unlink()
+
+    def _cached_paths(self):
+        if not self.path.is_dir():
+            return []
+        return list(self.path.glob(f'*{CACHE_FILE_SUFFIX}'))
+
+    def _evict(self, keep: Path):
+        """
+        Evict least recently used databases until the cache fits its size limit.
+        :param keep: Path to a database that should not be evicted.
+        """
+        if self.max_bytes is None:
+            return
+        cached = []
+        for cached_path in self._cached_paths():
+            try:
+                cached.append((cached_path.stat(), cached_path))
+            except FileNotFoundError:
+                continue
+        total_size = sum(stat.st_size for stat, _ in cached)
+        for stat, cached_path in sorted(cached, key=lambda item: item[0].st_mtime):
+            if total_size <= self.max_bytes:
+                break
+            if cached_path == keep:
+                continue
+            logger.debug(f'Evicting cached Manifest.db {cached_path}')
+            try:
+                cached_path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= stat.st_size
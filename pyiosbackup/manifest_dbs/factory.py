@@ -1,21 +1,25 @@
 from pathlib import Path
+from typing import Optional
 
 from packaging.version import Version
 
+from pyiosbackup.manifest_cache import ManifestCache
+
 from pyiosbackup.manifest_dbs.manifest_db_interface import ManifestDb
 from pyiosbackup.manifest_dbs.mbdb import ManifestDbMbdb
 from pyiosbackup.manifest_dbs.sqlite3 import ManifestDbSqlite3
 
 
-def from_path(backup_path: Path, manifest, keybag) -> ManifestDb:
+def from_path(backup_path: Path, manifest, keybag, manifest_cache: Optional[ManifestCache] = None) -> ManifestDb:
     """
     Load the Manifest.db.
     :param backup_path: Path to backup folder.
     :param manifest: Loaded Manifest.plist file.
     :param keybag: Backup keybag.
+    :param manifest_cache: Cache of decrypted Manifest.db files, only used by encrypted Manifest.db files.
     :return: Manifest.db object.
     """
     if manifest.product_version > Version('10.2'):
-        return ManifestDbSqlite3.from_path(backup_path / ManifestDbSqlite3.NAME, manifest, keybag)
+        return ManifestDbSqlite3.from_path(backup_path / ManifestDbSqlite3.NAME, manifest, keybag, manifest_cache)
     else:
         return ManifestDbMbdb.from_path(backup_path / ManifestDbMbdb.NAME, manifest, keybag)
@@ -1,5 +1,9 @@
+import shutil
 from abc import ABC, abstractmethod
 from pathlib import Path
+from typing import Optional
+
+from pyiosbackup.entry import EntryKind
 
 
 class ManifestDb(ABC):
@@ -22,5 +26,67 @@ class ManifestDb(ABC):
         pass
 
     @abstractmethod
-    def get_all_entries(self):
+    def get_metadata_by_ids(self, file_ids):
+        """
+        Get metadata of several entries by their IDs.
+        :param file_ids: Iterable of entries IDs.
+        :return: Mapping between IDs and their metadata, None for missing entries.
+        :rtype: dict
+        """
+        pass
+
+    @abstractmethod
+    def get_metadata_by_domains_and_paths(self, domains_and_paths):
+        """
+        Get metadata of several entries by their domains and relative paths.
+        :param domains_and_paths: Iterable of (domain, relative path) pairs.
+        :return: Mapping between pairs and their metadata, None for missing entries.
+        :rtype: dict
+        """
+        pass
+
+    @abstractmethod
+    def get_domains(self):
+        """
+        Get the names of all domains that have entries.
+        :return: Sorted list of domains.
+        :rtype: list
+        """
+        pass
+
+    @abstractmethod
+    def get_all_entries(self, lazy: bool = False, domain: Optional[str] = None, domain_prefix: Optional[str] = None,
+                        path_glob: Optional[str] = None, kind: Optional[EntryKind] = None):
+        """
+        Get metadata of all entries, optionally filtered.
+        :param lazy: Only load the ID, domain and relative path of every entry. The rest of the metadata is returned
+        by calling the entry's `load_metadata`. Databases that compute IDs may leave them out, and return them from
+        `load_metadata` instead.
+        :param domain: Only get entries of this domain.
+        :param domain_prefix: Only get entries of domains starting with this prefix, e.g. 'AppDomain-com.whatsapp'.
+        :param path_glob: Only get entries whose relative path matches this glob, where `*` also matches `/`.
+        :param kind: Only get entries of this kind.
+        """
+        pass
+
+    @abstractmethod
+    def get_sorted_entries(self):
+        """
+        Get lazily loaded metadata of all entries, sorted by their domains and relative paths.
+        Every entry also has a `raw_metadata` key, which is equal for entries with equal metadata in databases of the
+        same format, so comparing entries usually doesn't require loading their metadata.
+        """
+        pass
+
+    def save(self, path: Path):
+        """
+        Save a decrypted copy of the database.
+        :param path: Destination path.
+        """
+        shutil.copy2(self.path, path)
+
+    def close(self):
+        """
+        Release resources held by the database.
+        """
         pass
@@ -1,88 +1,250 @@
+import fnmatch
+import functools
 import hashlib
+import mmap
+import struct
+from array import array
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
-from construct import Array, Byte, Bytes, Computed, Const, GreedyRange, IfThenElse, Int16ub, Int32ub, Int64ub, \
-    PaddedString, Struct, this
-
+from pyiosbackup.entry import EntryKind
 from pyiosbackup.exceptions import MissingEntryError
 from pyiosbackup.manifest_dbs.manifest_db_interface import ManifestDb
 
-mbdb_struct = Struct(
-    Const(b'mbdb', Bytes(4)),
-    'version' / Const(b'\x05\x00', Bytes(2)),
-    'records' / GreedyRange(Struct(
-        'domain_len' / Int16ub,
-        'domain' / IfThenElse(this.domain_len != 0xffff, PaddedString(this.domain_len, 'utf8'), Computed('')),
-        'filename_len' / Int16ub,
-        'filename' / IfThenElse(this.filename_len != 0xffff, PaddedString(this.filename_len, 'utf8'), Computed('')),
-        'link_len' / Int16ub,
-        'linktarget' / IfThenElse(this.link_len != 0xffff, PaddedString(this.link_len, 'utf8'), Computed('')),
-        'hash_len' / Int16ub,
-        'data_hash' / IfThenElse(this.hash_len != 0xffff, Bytes(this.hash_len), Computed(b'')),
-        'key_length' / Int16ub,
-        'encryption_key' / IfThenElse(this.key_length != 0xffff, Bytes(this.key_length), Computed(b'')),
-        'mode' / Int16ub,
-        'unknown2' / Int32ub,
-        'unknown3' / Int32ub,
-        'user_id' / Int32ub,
-        'group_id' / Int32ub,
-        'mtime' / Int32ub,
-        'atime' / Int32ub,
-        'ctime' / Int32ub,
-        'size' / Int64ub,
-        'flags' / Byte,
-        'properties_count' / Byte,
-        'properties' / Array(this.properties_count, Struct(
-            'name_len' / Int16ub,
-            'name' / IfThenElse(this.name_len != 0xffff, PaddedString(this.name_len, 'utf8'), Computed('')),
-            'value_len' / Int16ub,
-            'value' / IfThenElse(this.value_len != 0xffff, PaddedString(this.value_len, 'utf8'), Computed('')),
-        )),
-    ))
-)
+MBDB_HEADER = b'mbdb\x05\x00'
+EMPTY_LENGTH = 0xffff
+length_struct = struct.Struct('>H')
+# Mode, two unknown fields, user id, group id, mtime, atime, ctime, size, flags and properties count.
+record_fields_struct = struct.Struct('>HIIIIIIIQBB')
 
 
 class ManifestDbMbdb(ManifestDb):
     NAME = 'Manifest.mbdb'
 
-    def __init__(self, path, records):
+    def __init__(self, path, data):
+        """
+        Create a Manifest.mbdb object.
+        Records are parsed from the raw data when accessed, only their offsets are kept in memory.
+        :param path: Path to Manifest.mbdb.
+        :param data: Raw Manifest.mbdb data, either bytes or a memory map.
+        """
         super().__init__(path)
-        self.records = records
+        if data[:len(MBDB_HEADER)] != MBDB_HEADER:
+            raise ValueError('Invalid Manifest.mbdb header')
+        self._data = data
+        self._offsets = array('Q', iter_records_offsets(data))
+        # Mapping between binary file IDs and records indices, built on first lookup.
+        self._ids_index = None
 
     @classmethod
     def from_path(cls, path: Path, manifest, keybag):
-        mbdb = mbdb_struct.parse(path.read_bytes())
-        records = []
-        for record in mbdb.records:
-            domain = record['domain']
-            filename = record['filename']
-            records.append({
-                'file_id': hashlib.sha1(f'{domain}-{filename}'.encode()).hexdigest(),
-                'domain': domain,
-                'relative_path': filename,
-                'last_modified': datetime.fromtimestamp(record['mtime'], timezone.utc),
-                'created': datetime.fromtimestamp(record['ctime'], timezone.utc),
-                'last_status_change': datetime.fromtimestamp(record['atime'], timezone.utc),
-                'size': record['size'],
-                'mode': record['mode'],
-                'group_id': record['group_id'],
-                'user_id': record['user_id'],
-                'encryption_key': record['encryption_key'],
-            })
-        return ManifestDbMbdb(path, records)
+        with open(path, 'rb') as mbdb:
+            data = mmap.mmap(mbdb.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(path, data)
+        except ValueError:
+            data.close()
+            raise
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
 
     def get_metadata_by_id(self, file_id: str):
-        for record in self.records:
-            if record['file_id'] == file_id:
-                return record
-        raise MissingEntryError()
+        index = self._get_index_by_id(file_id)
+        if index is None:
+            raise MissingEntryError()
+        return self._load_entry(self._offsets[index])
 
     def get_metadata_by_domain_and_path(self, domain: str, relative_path: str):
-        for record in self.records:
-            if record['domain'] == domain and record['relative_path'] == relative_path:
-                return record
-        raise MissingEntryError()
+        index = self._get_index_by_domain_and_path(domain, relative_path)
+        if index is None:
+            raise MissingEntryError()
+        return self._load_entry(self._offsets[index])
+
+    def get_metadata_by_ids(self, file_ids):
+        return {file_id: self._load_entry_or_none(self._get_index_by_id(file_id)) for file_id in file_ids}
+
+    def get_metadata_by_domains_and_paths(self, domains_and_paths):
+        return {
+            (domain, relative_path): self._load_entry_or_none(self._get_index_by_domain_and_path(domain, relative_path))
+            for domain, relative_path in domains_and_paths
+        }
+
+    def get_domains(self):
+        return sorted({_parse_string(self._data, offset)[0].decode() for offset in self._offsets})
+
+    def get_all_entries(self, lazy: bool = False, domain: Optional[str] = None, domain_prefix: Optional[str] = None,
+                        path_glob: Optional[str] = None, kind: Optional[EntryKind] = None):
+        kind = None if kind is None else EntryKind(kind)
+        for offset in self._offsets:
+            record = parse_record(self._data, offset)
+            if domain is not None and record['domain'] != domain:
+                continue
+            if domain_prefix is not None and not record['domain'].startswith(domain_prefix):
+                continue
+            if path_glob is not None and not fnmatch.fnmatchcase(record['filename'], path_glob):
+                continue
+            if kind is not None and EntryKind.from_mode(record['mode']) != kind:
+                continue
+            yield _load_lazy_entry(record) if lazy else _load_entry(record)
+
+    def get_sorted_entries(self):
+        # Records are not sorted in the file, so only their keys are sorted in memory.
+        keys = []
+        for offset in self._offsets:
+            domain, pos = _parse_string(self._data, offset)
+            filename, _ = _parse_string(self._data, pos)
+            keys.append((domain.decode(), filename.decode()))
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        del keys
+        for index in order:
+            offset = self._offsets[index]
+            end = self._offsets[index + 1] if index + 1 < len(self._offsets) else len(self._data)
+            yield {**_load_lazy_entry(parse_record(self._data, offset)), 'raw_metadata': bytes(self._data[offset:end])}
+
+    def _load_entry(self, offset: int):
+        return _load_entry(parse_record(self._data, offset))
+
+    def _load_entry_or_none(self, index):
+        return None if index is None else self._load_entry(self._offsets[index])
+
+    def _get_index_by_id(self, file_id: str) -> Optional[int]:
+        try:
+            return self._get_ids_index().get(bytes.fromhex(file_id))
+        except ValueError:
+            return None
+
+    def _get_index_by_domain_and_path(self, domain: str, relative_path: str) -> Optional[int]:
+        # File IDs are hashes of the domain and path, so the same index serves both kinds of lookups.
+        index = self._get_ids_index().get(_file_id(domain, relative_path))
+        if index is None:
+            return None
+        record = parse_record(self._data, self._offsets[index])
+        if record['domain'] == domain and record['filename'] == relative_path:
+            return index
+        # The domain and path are joined by a dash before hashing, so different pairs may share an ID.
+        for index, offset in enumerate(self._offsets):
+            record = parse_record(self._data, offset)
+            if record['domain'] == domain and record['filename'] == relative_path:
+                return index
+        return None
+
+    def _get_ids_index(self):
+        if self._ids_index is None:
+            self._ids_index = {}
+            for index, offset in enumerate(self._offsets):
+                domain, pos = _parse_string(self._data, offset)
+                filename, _ = _parse_string(self._data, pos)
+                self._ids_index.setdefault(_file_id(domain.decode(), filename.decode()), index)
+        return self._ids_index
+
+
+def iter_records_offsets(data):
+    """
+    Iterate the offsets of all records in a Manifest.mbdb, without decoding them.
+    :param data: Raw Manifest.mbdb data.
+    """
+    pos = len(MBDB_HEADER)
+    size = len(data)
+    while pos < size:
+        yield pos
+        try:
+            for _ in range(5):
+                # Domain, filename, link target, data hash and encryption key.
+                _, pos = _parse_string(data, pos)
+            properties_count = data[pos + record_fields_struct.size - 1]
+            pos += record_fields_struct.size
+            for _ in range(2 * properties_count):
+                _, pos = _parse_string(data, pos)
+        except (struct.error, IndexError) as e:
+            raise ValueError('Truncated Manifest.mbdb record') from e
+    if pos != size:
+        raise ValueError('Truncated Manifest.mbdb record')
+
+
+def parse_record(data, pos: int):
+    """
+    Parse a single Manifest.mbdb record.
+    :param data: Raw Manifest.mbdb data.
+    :param pos: Offset of the record.
+    :return: Parsed record.
+    :rtype: dict
+    """
+    domain, pos = _parse_string(data, pos)
+    filename, pos = _parse_string(data, pos)
+    link_target, pos = _parse_string(data, pos)
+    data_hash, pos = _parse_string(data, pos)
+    encryption_key, pos = _parse_string(data, pos)
+    mode, _, _, user_id, group_id, mtime, atime, ctime, size, flags, _ = record_fields_struct.unpack_from(data, pos)
+    return {
+        'domain': domain.decode(),
+        'filename': filename.decode(),
+        'linktarget': link_target.decode(),
+        'data_hash': data_hash,
+        'encryption_key': encryption_key,
+        'mode': mode,
+        'user_id': user_id,
+        'group_id': group_id,
+        'mtime': mtime,
+        'atime': atime,
+        'ctime': ctime,
+        'size': size,
+        'flags': flags,
+    }
+
+
+def _parse_string(data, pos: int):
+    """
+    Parse a length prefixed string, a length of 0xffff marks an empty string.
+    :return: Raw string and the offset right after it.
+    """
+    length, = length_struct.unpack_from(data, pos)
+    pos += length_struct.size
+    if length == EMPTY_LENGTH:
+        return b'', pos
+    if pos + length > len(data):
+        raise ValueError('Truncated Manifest.mbdb record')
+    return data[pos:pos + length], pos + length
+
+
+def _file_id(domain: str, relative_path: str) -> bytes:
+    return hashlib.sha1(f'{domain}-{relative_path}'.encode()).digest()
+
+
+def _load_metadata(record):
+    return {
+        'last_modified': datetime.fromtimestamp(record['mtime'], timezone.utc),
+        'created': datetime.fromtimestamp(record['ctime'], timezone.utc),
+        'last_status_change': datetime.fromtimestamp(record['atime'], timezone.utc),
+        'size': record['size'],
+        'mode': record['mode'],
+        'group_id': record['group_id'],
+        'user_id': record['user_id'],
+        'encryption_key': record['encryption_key'],
+        'link_target': record['linktarget'],
+        'digest': record['data_hash'],
+    }
+
+
+def _load_lazy_entry(record):
+    # IDs are hashed on demand, as lazy entries are mostly filtered by their domain and path.
+    return {
+        'domain': record['domain'],
+        'relative_path': record['filename'],
+        'load_metadata': functools.partial(_load_lazy_metadata, record),
+    }
+
+
+def _load_lazy_metadata(record):
+    return {'file_id': _file_id(record['domain'], record['filename']).hex(), **_load_metadata(record)}
+
 
-    def get_all_entries(self):
-        return self.records
+def _load_entry(record):
+    return {
+        'file_id': _file_id(record['domain'], record['filename']).hex(),
+        'domain': record['domain'],
+        'relative_path': record['filename'],
+        **_load_metadata(record),
+    }
@@ -0,0 +1,185 @@
+import struct
+from dataclasses import dataclass
+
+from bpylist2 import archiver
+
+BPLIST_MAGIC = b'bplist00'
+BPLIST_TRAILER = struct.Struct('>6xBBQQQ')
+UNSIGNED_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+MARKER_INT = 0x1
+MARKER_DATA = 0x4
+MARKER_ASCII = 0x5
+MARKER_UTF16 = 0x6
+MARKER_UID = 0x8
+MARKER_ARRAY = 0xA
+MARKER_DICT = 0xD
+SHORT_ASCII_MIN = MARKER_ASCII << 4
+SHORT_ASCII_MAX = (MARKER_ASCII << 4) | 0xE
+
+MBFILE_INT_FIELDS = {
+    b'LastModified': 'last_modified',
+    b'LastStatusChange': 'last_status_change',
+    b'Birth': 'created',
+    b'Size': 'size',
+    b'Mode': 'mode',
+    b'GroupID': 'group_id',
+    b'UserID': 'user_id',
+}
+
+
+@dataclass
+class MBFile:
+    relative_path: str
+    last_modified: int
+    last_status_change: int
+    created: int
+    size: int
+    mode: int
+    group_id: int
+    user_id: int
+    encryption_key: bytes = b''
+    link_target: str = ''
+
+    @staticmethod
+    def decode_archive(archive_obj):
+        return MBFile(
+            relative_path=archive_obj.decode('RelativePath'),
+            last_modified=archive_obj.object['LastModified'],
+            last_status_change=archive_obj.object['LastStatusChange'],
+            created=archive_obj.object['Birth'],
+            size=archive_obj.object['Size'],
+            mode=archive_obj.object['Mode'],
+            group_id=archive_obj.object['GroupID'],
+            user_id=archive_obj.object['UserID'],
+            encryption_key=archive_obj.decode('EncryptionKey').NSdata if 'EncryptionKey' in archive_obj.object else b'',
+            link_target=archive_obj.decode('Target') if 'Target' in archive_obj.object else '',
+        )
+
+
+archiver.update_class_map({'MBFile': MBFile})
+
+
+def decode_mbfile(data: bytes) -> MBFile:
+    """
+    Decode an archived MBFile.
+    The archive is parsed directly, resolving only the objects an MBFile needs. Archives with an unexpected layout are
+    decoded using the generic archiver.
+    :param data: NSKeyedArchiver binary plist.
+    :return: Decoded MBFile.
+    """
+    try:
+        return _decode_mbfile(data)
+    except (ValueError, KeyError, IndexError, struct.error, UnicodeDecodeError):
+        return archiver.unarchive(data)
+
+
+def _decode_mbfile(data: bytes) -> MBFile:
+    if not data.startswith(BPLIST_MAGIC):
+        raise ValueError('Not a binary plist')
+    offset_size, ref_size, count, top, table = BPLIST_TRAILER.unpack_from(data, len(data) - BPLIST_TRAILER.size)
+    offsets = struct.unpack_from(f'>{count}{UNSIGNED_FORMATS[offset_size]}', data, table)
+    ref_format = UNSIGNED_FORMATS[ref_size]
+
+    archive = _read_dict(data, offsets, offsets[top], ref_format)
+    objects = _read_array(data, offsets[archive[b'$objects']], ref_format)
+    top_objects = _read_dict(data, offsets, offsets[archive[b'$top']], ref_format)
+    # Archived objects are referenced by a UID, which is an index into the `$objects` array.
+    mb_file = _read_dict(data, offsets, offsets[objects[_read_uid(data, offsets[top_objects[b'root']])]], ref_format)
+    class_ = _read_dict(data, offsets, offsets[objects[_read_uid(data, offsets[mb_file[b'$class']])]], ref_format)
+    if _read_raw(data, offsets[class_[b'$classname']]) != b'MBFile':
+        raise ValueError('Not an MBFile archive')
+
+    fields = {}
+    for key, ref in mb_file.items():
+        field = MBFILE_INT_FIELDS.get(key)
+        if field is not None:
+            fields[field] = _read_int(data, offsets[ref])
+    relative_path_uid = _read_uid(data, offsets[mb_file[b'RelativePath']])
+    fields['relative_path'] = _read_raw(data, offsets[objects[relative_path_uid]]).decode()
+    if b'Target' in mb_file:
+        target_uid = _read_uid(data, offsets[mb_file[b'Target']])
+        fields['link_target'] = _read_raw(data, offsets[objects[target_uid]]).decode()
+    if b'EncryptionKey' in mb_file:
+        key_uid = _read_uid(data, offsets[mb_file[b'EncryptionKey']])
+        key_pos = offsets[_read_dict(data, offsets, offsets[objects[key_uid]], ref_format)[b'NS.data']]
+        if data[key_pos] >> 4 == MARKER_UID:
+            key_pos = offsets[objects[_read_uid(data, key_pos)]]
+        if data[key_pos] >> 4 != MARKER_DATA:
+            raise ValueError('Expected data object')
+        fields['encryption_key'] = _read_raw(data, key_pos)
+    return MBFile(**fields)
+
+
+def _read_length(data: bytes, pos: int):
+    """
+    Read the length of a variable sized object.
+    :return: Object marker type, object length and the position of the object content.
+    """
+    marker = data[pos]
+    length = marker & 0xF
+    if length != 0xF:
+        return marker >> 4, length, pos + 1
+    size = 1 << (data[pos + 1] & 0xF)
+    return marker >> 4, int.from_bytes(data[pos + 2:pos + 2 + size], 'big'), pos + 2 + size
+
+
+def _read_raw(data: bytes, pos: int) -> bytes:
+    """
+    Read the content of a data or string object, UTF-16 strings are re-encoded as UTF-8.
+    """
+    marker, length, pos = _read_length(data, pos)
+    if marker == MARKER_UTF16:
+        return data[pos:pos + 2 * length].decode('utf-16-be').encode()
+    if marker not in (MARKER_DATA, MARKER_ASCII):
+        raise ValueError('Expected data or string object')
+    return data[pos:pos + length]
+
+
+def _read_int(data: bytes, pos: int) -> int:
+    marker = data[pos]
+    if marker >> 4 != MARKER_INT:
+        raise ValueError('Expected integer object')
+    size = 1 << (marker & 0xF)
+    # Only 8 bytes integers (and larger) are signed.
+    return int.from_bytes(data[pos + 1:pos + 1 + size], 'big', signed=size >= 8)
+
+
+def _read_uid(data: bytes, pos: int) -> int:
+    marker = data[pos]
+    if marker >> 4 != MARKER_UID:
+        raise ValueError('Expected UID object')
+    return int.from_bytes(data[pos + 1:pos + 2 + (marker & 0xF)], 'big')
+
+
+def _read_array(data: bytes, pos: int, ref_format: str):
+    marker, length, pos = _read_length(data, pos)
+    if marker != MARKER_ARRAY:
+        raise ValueError('Expected array object')
+    return struct.unpack_from(f'>{length}{ref_format}', data, pos)
+
+
+def _read_dict(data: bytes, offsets, pos: int, ref_format: str):
+    """
+    Read a dictionary object.
+    :return: Mapping between raw keys and their value references.
+    """
+    marker = data[pos]
+    length = marker & 0xF
+    if marker >> 4 != MARKER_DICT:
+        raise ValueError('Expected dictionary object')
+    if length == 0xF:
+        _, length, pos = _read_length(data, pos)
+    else:
+        pos += 1
+    refs = struct.unpack_from(f'>{2 * length}{ref_format}', data, pos)
+    keys = []
+    for key in refs[:length]:
+        key_pos = offsets[key]
+        marker = data[key_pos]
+        # Fast path for short ASCII keys, which all of the archive keys are.
+        if SHORT_ASCII_MIN <= marker <= SHORT_ASCII_MAX:
+            keys.append(data[key_pos + 1:key_pos + 1 + (marker & 0xF)])
+        else:
+            keys.append(_read_raw(data, key_pos))
+    return dict(zip(keys, refs[length:]))
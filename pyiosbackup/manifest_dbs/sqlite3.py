@@ -1,94 +1,226 @@
+import functools
 import logging
+import os
 import sqlite3
 import tempfile
-from dataclasses import dataclass
+import weakref
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
-from bpylist2 import archiver
-
+from pyiosbackup.entry import EntryKind
 from pyiosbackup.exceptions import MissingEntryError
+from pyiosbackup.manifest_cache import ManifestCache
 from pyiosbackup.manifest_dbs.manifest_db_interface import ManifestDb
+from pyiosbackup.manifest_dbs.mbfile import MBFile, decode_mbfile  # noqa: F401
 
 ENTRIES_QUERY = 'SELECT * FROM Files'
+# Values of the `flags` column, rows with other values (such as 0) are checked by their decoded mode.
+KINDS_FLAGS = {
+    EntryKind.FILE: 1,
+    EntryKind.DIRECTORY: 2,
+    EntryKind.SYMLINK: 4,
+}
+# Maximal number of keys looked up by a single query, keeping below the default limit of 999 parameters.
+LOOKUP_CHUNK_SIZE = 400
+# Statements are cached per connection, so repeated lookups skip parsing and planning their queries.
+CACHED_STATEMENTS = 256
+PRAGMAS = {
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative values are in KiB.
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+DOMAIN_PATH_INDEX_NAME = 'FilesDomainRelativePathIdx'
+# Connections may be used by other threads than the one that created them, as long as their use is serialized.
+CHECK_SAME_THREAD = False
+# `Connection.deserialize` is only available from python 3.11, when sqlite is compiled with it.
+SUPPORTS_DESERIALIZE = hasattr(sqlite3.Connection, 'deserialize')
 
 logger = logging.getLogger('pyiosbackup')
 
 
-@dataclass
-class MBFile:
-    relative_path: str
-    last_modified: int
-    last_status_change: int
-    created: int
-    size: int
-    mode: int
-    group_id: int
-    user_id: int
-    encryption_key: bytes = b''
-
-    @staticmethod
-    def decode_archive(archive_obj):
-        return MBFile(
-            relative_path=archive_obj.decode('RelativePath'),
-            last_modified=archive_obj.object['LastModified'],
-            last_status_change=archive_obj.object['LastStatusChange'],
-            created=archive_obj.object['Birth'],
-            size=archive_obj.object['Size'],
-            mode=archive_obj.object['Mode'],
-            group_id=archive_obj.object['GroupID'],
-            user_id=archive_obj.object['UserID'],
-            encryption_key=archive_obj.decode('EncryptionKey').NSdata if 'EncryptionKey' in archive_obj.object else b'',
-        )
-
-
-archiver.update_class_map({'MBFile': MBFile})
+def glob_escape(text: str) -> str:
+    """
+    Escape text to be matched literally by sqlite GLOB.
+    """
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in text)
+
+
+def connect_read_only(path: Path) -> sqlite3.Connection:
+    """
+    Connect to a database that is never modified, letting sqlite skip locking and change detection.
+    :param path: Path to database.
+    """
+    return sqlite3.connect(f'{Path(path).absolute().as_uri()}?mode=ro&immutable=1', uri=True,
+                           cached_statements=CACHED_STATEMENTS, check_same_thread=CHECK_SAME_THREAD)
+
+
+def ensure_domain_path_index(path: Path):
+    """
+    Create an index of entries domains and relative paths if the database doesn't have one.
+    Should only be used on decrypted copies before they are shared, never on the backup itself.
+    :param path: Path to database.
+    """
+    conn = sqlite3.connect(str(path))
+    try:
+        for index in conn.execute('PRAGMA index_list(Files)').fetchall():
+            columns = [column[2] for column in conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()]
+            if columns[:2] == ['domain', 'relativePath']:
+                return
+        logger.debug(f'Creating domain and relative path index in {path}')
+        with conn:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {DOMAIN_PATH_INDEX_NAME} ON Files (domain, relativePath)')
+    finally:
+        conn.close()
 
 
 class ManifestDbSqlite3(ManifestDb):
     NAME = 'Manifest.db'
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, conn: sqlite3.Connection, temporary_path: Path = None):
+        """
+        Create a Manifest.db object.
+        :param path: Path to the original Manifest.db.
+        :param conn: Connection to the decrypted database.
+        :param temporary_path: Path to a decrypted copy of the database, removed when closing.
+        """
         super().__init__(path)
-        self._conn = sqlite3.connect(str(path))
+        self._conn = conn
         self._conn.row_factory = sqlite3.Row
+        for pragma, value in PRAGMAS.items():
+            self._conn.execute(f'PRAGMA {pragma} = {value}')
+        self._temporary_path = temporary_path
+        # The decrypted copy is removed even if the database is never closed, as it holds the manifest in plaintext.
+        self._finalizer = weakref.finalize(self, _remove_temporary_copy, conn, temporary_path)
 
     @classmethod
-    def from_path(cls, path: Path, manifest, keybag):
-        manifest_db = path.read_bytes()
-        if manifest.is_encrypted:
-            manifest_db = keybag.decrypt(manifest_db, manifest.manifest_key)
-        manifest_db_file = tempfile.NamedTemporaryFile(suffix='sqlite3', delete=False)
-        logger.debug(f'Writing decrypted backup to {manifest_db_file.name}')
-        manifest_db_file.write(manifest_db)
-        return cls(Path(manifest_db_file.name))
+    def from_path(cls, path: Path, manifest, keybag, manifest_cache: Optional[ManifestCache] = None):
+        if not manifest.is_encrypted:
+            return cls(path, connect_read_only(path))
+        fingerprint = None
+        if manifest_cache is not None:
+            fingerprint = manifest_cache.fingerprint(path, manifest.manifest_key)
+            cached_path = manifest_cache.get(fingerprint)
+            if cached_path is not None:
+                return cls(path, connect_read_only(cached_path))
+        manifest_db = keybag.decrypt(path.read_bytes(), manifest.manifest_key)
+        if manifest_cache is not None:
+            cached_path = manifest_cache.put(fingerprint, manifest_db, prepare=ensure_domain_path_index)
+            return cls(path, connect_read_only(cached_path))
+        if SUPPORTS_DESERIALIZE:
+            logger.debug('Loading decrypted backup to memory')
+            conn = sqlite3.connect(':memory:', cached_statements=CACHED_STATEMENTS, check_same_thread=CHECK_SAME_THREAD)
+            conn.deserialize(manifest_db)
+            return cls(path, conn)
+        fd, temporary_path = tempfile.mkstemp(suffix='.sqlite3')
+        logger.debug(f'Writing decrypted backup to {temporary_path}')
+        with os.fdopen(fd, 'wb') as manifest_db_file:
+            manifest_db_file.write(manifest_db)
+        conn = sqlite3.connect(temporary_path, cached_statements=CACHED_STATEMENTS, check_same_thread=CHECK_SAME_THREAD)
+        return cls(path, conn, Path(temporary_path))
+
+    def save(self, path: Path):
+        dest = sqlite3.connect(str(path))
+        try:
+            self._conn.backup(dest)
+        finally:
+            dest.close()
+
+    def close(self):
+        self._finalizer()
 
     def get_metadata_by_id(self, file_id: str):
-        return self._fetch_one_entry(f'{ENTRIES_QUERY} WHERE fileID=\'{file_id}\'')
+        return self._fetch_one_entry(f'{ENTRIES_QUERY} WHERE fileID = ?', (file_id,))
 
     def get_metadata_by_domain_and_path(self, domain: str, relative_path: str):
-        return self._fetch_one_entry(f'{ENTRIES_QUERY} WHERE domain=\'{domain}\' AND relativePath=\'{relative_path}\'')
-
-    def get_all_entries(self):
-        return map(self._load_entry, self._cursor.execute(f'{ENTRIES_QUERY} ORDER BY relativePath').fetchall())
-
-    @property
-    def _cursor(self):
-        return self._conn.cursor()
-
-    def _fetch_one_entry(self, query):
-        result = self._cursor.execute(query).fetchone()
+        return self._fetch_one_entry(f'{ENTRIES_QUERY} WHERE domain = ? AND relativePath = ?', (domain, relative_path))
+
+    def get_metadata_by_ids(self, file_ids):
+        file_ids = list(dict.fromkeys(file_ids))
+        result = dict.fromkeys(file_ids)
+        for chunk in _chunks(file_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            for row in self._conn.execute(f'{ENTRIES_QUERY} WHERE fileID IN ({placeholders})', chunk):
+                result[row['fileID']] = self._load_entry(row)
+        return result
+
+    def get_metadata_by_domains_and_paths(self, domains_and_paths):
+        domains_and_paths = list(dict.fromkeys((domain, relative_path) for domain, relative_path in domains_and_paths))
+        result = dict.fromkeys(domains_and_paths)
+        for chunk in _chunks(domains_and_paths):
+            placeholders = ', '.join(['(?, ?)'] * len(chunk))
+            parameters = [value for pair in chunk for value in pair]
+            query = f'{ENTRIES_QUERY} WHERE (domain, relativePath) IN (VALUES {placeholders})'
+            for row in self._conn.execute(query, parameters):
+                result[(row['domain'], row['relativePath'])] = self._load_entry(row)
+        return result
+
+    def get_domains(self):
+        return [row['domain'] for row in self._conn.execute('SELECT DISTINCT domain FROM Files ORDER BY domain')]
+
+    def get_all_entries(self, lazy: bool = False, domain: Optional[str] = None, domain_prefix: Optional[str] = None,
+                        path_glob: Optional[str] = None, kind: Optional[EntryKind] = None):
+        conditions = []
+        parameters = []
+        if domain is not None:
+            conditions.append('domain = ?')
+            parameters.append(domain)
+        if domain_prefix is not None:
+            conditions.append('domain GLOB ?')
+            parameters.append(f'{glob_escape(domain_prefix)}*')
+        if path_glob is not None:
+            conditions.append('relativePath GLOB ?')
+            parameters.append(path_glob)
+        if kind is not None:
+            kind = EntryKind(kind)
+            known_flags = ', '.join(str(flags) for flags in KINDS_FLAGS.values())
+            conditions.append(f'(flags = ? OR flags NOT IN ({known_flags}))')
+            parameters.append(KINDS_FLAGS[kind])
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self._conn.execute(f'{ENTRIES_QUERY}{where} ORDER BY relativePath', parameters)
+        if kind is not None:
+            rows = (row for row in rows if self._is_kind(row, kind))
+        return map(self._load_lazy_entry if lazy else self._load_entry, rows)
+
+    def get_sorted_entries(self):
+        for row in self._conn.execute(f'{ENTRIES_QUERY} ORDER BY domain, relativePath'):
+            yield {**self._load_lazy_entry(row), 'raw_metadata': row['file']}
+
+    def _fetch_one_entry(self, query: str, parameters):
+        result = self._conn.execute(query, parameters).fetchone()
         if result is None:
             raise MissingEntryError()
         return self._load_entry(result)
 
+    @staticmethod
+    def _is_kind(entry, kind: EntryKind) -> bool:
+        if entry['flags'] in KINDS_FLAGS.values():
+            return entry['flags'] == KINDS_FLAGS[kind]
+        return EntryKind.from_mode(decode_mbfile(entry['file']).mode) == kind
+
     @staticmethod
     def _load_entry(entry):
-        mb_info = archiver.unarchive(entry['file'])  # type: MBFile
         return {
             'file_id': entry['fileID'],
             'domain': entry['domain'],
             'relative_path': entry['relativePath'],
+            **ManifestDbSqlite3._load_metadata(entry['file']),
+        }
+
+    @staticmethod
+    def _load_lazy_entry(entry):
+        return {
+            'file_id': entry['fileID'],
+            'domain': entry['domain'],
+            'relative_path': entry['relativePath'],
+            'load_metadata': functools.partial(ManifestDbSqlite3._load_metadata, entry['file']),
+        }
+
+    @staticmethod
+    def _load_metadata(file):
+        mb_info = decode_mbfile(file)
+        return {
             'last_modified': datetime.fromtimestamp(mb_info.last_modified, timezone.utc),
             'created': datetime.fromtimestamp(mb_info.created, timezone.utc),
             'last_status_change': datetime.fromtimestamp(mb_info.last_status_change, timezone.utc),
@@ -97,4 +229,17 @@ class ManifestDbSqlite3(ManifestDb):
             'group_id': mb_info.group_id,
             'user_id': mb_info.user_id,
             'encryption_key': mb_info.encryption_key,
+            'link_target': mb_info.link_target,
+            'digest': b'',
         }
+
+
+def _remove_temporary_copy(conn: sqlite3.Connection, temporary_path: Optional[Path]):
+    conn.close()
+    if temporary_path is not None and temporary_path.exists():
+        temporary_path.unlink()
+
+
+def _chunks(items: list):
+    for i in range(0, len(items), LOOKUP_CHUNK_SIZE):
+        yield items[i:i + LOOKUP_CHUNK_SIZE]
@@ -9,6 +9,7 @@ class ManifestPlist:
 
     def __init__(self, plist_data):
         self._plist_data = plist_data
+        self._product_version = None
 
     @staticmethod
     def from_path(path: Path):
@@ -34,4 +35,7 @@ class ManifestPlist:
 
     @property
     def product_version(self) -> Version:
-        return Version(self._plist_data['Lockdown']['ProductVersion'])
+        # Parsed once, since it is checked for every entry path.
+        if self._product_version is None:
+            self._product_version = Version(self._plist_data['Lockdown']['ProductVersion'])
+        return self._product_version
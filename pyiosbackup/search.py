@@ -0,0 +1,54 @@
+import re
+
+SEARCH_CHUNK_SIZE = 1024 * 1024
+# Matches starting this close to the end of a chunk are searched again along with the next chunk, so matches up to
+# this length are found even when they span two chunks.
+SEARCH_OVERLAP = 4096
+# Suffixes of media files, which are usually large and rarely worth searching.
+MEDIA_SUFFIXES = (
+    '.jpg', '.jpeg', '.png', '.gif', '.heic', '.heif', '.mov', '.mp4', '.m4v', '.m4a', '.mp3', '.aac', '.caf', '.amr',
+    '.opus', '.wav',
+)
+
+
+def compile_pattern(pattern, flags: int = 0):
+    """
+    Compile a pattern to search decrypted data with.
+    :param pattern: Regular expression, either str (matched as UTF-8) or bytes, or an already compiled bytes pattern.
+    :param flags: Regular expression flags, e.g. re.IGNORECASE.
+    :rtype: re.Pattern
+    """
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    return re.compile(pattern, flags)
+
+
+def search_file(file, regex, overlap: int = SEARCH_OVERLAP, chunk_size: int = SEARCH_CHUNK_SIZE):
+    """
+    Search a file in chunks, without reading all of it to memory.
+    :param file: Binary file object to search.
+    :param regex: Compiled bytes pattern.
+    :param overlap: Number of bytes each chunk is searched along with the next one, limiting the length of matches
+    that span chunks.
+    :param chunk_size: Number of bytes read at once.
+    :return: Generator of matches offsets.
+    """
+    buffer = b''
+    buffer_offset = 0
+    while True:
+        chunk = file.read(chunk_size)
+        buffer += chunk
+        # Matches starting within the overlap are left to the next chunk, unless this is the last one.
+        end = max(len(buffer) - overlap, 0) if chunk else len(buffer)
+        resume = end
+        for match in regex.finditer(buffer):
+            if match.start() >= end:
+                break
+            yield buffer_offset + match.start()
+            resume = max(resume, match.end())
+        if not chunk:
+            return
+        buffer = buffer[resume:]
+        buffer_offset += resume
@@ -0,0 +1,234 @@
+import html
+import io
+import json
+import logging
+import mimetypes
+import posixpath
+import re
+import threading
+import urllib.parse
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyiosbackup.exceptions import MissingEntryError
+
+DOMAINS_PREFIX = '/domains/'
+IDS_PREFIX = '/ids/'
+COPY_BUFFER_SIZE = 1024 * 1024
+# Only single ranges are served, requests for several ranges get the whole entry.
+range_regex = re.compile(r'bytes=(\d*)-(\d*)$')
+
+logger = logging.getLogger('pyiosbackup')
+
+
+class BackupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, backup, address=('127.0.0.1', 8000)):
+        """
+        Create a read-only HTTP server of a backup, decrypting entries on demand.
+        Entries are served by their domains and relative paths under /domains/, and by their IDs under /ids/.
+        Directories are listed as HTML, or as JSON for requests accepting `application/json`.
+        Every request is handled by its own thread. Manifest lookups are serialized by a lock, while entries are
+        decrypted concurrently.
+        :param backup: Backup to serve.
+        :param address: Address to listen on, as a (host, port) pair.
+        """
+        super().__init__(address, BackupRequestHandler)
+        self.backup = backup
+        self.lock = threading.Lock()
+        self._domains = None
+
+    def get_domains(self):
+        with self.lock:
+            if self._domains is None:
+                self._domains = self.backup.get_domains()
+            return self._domains
+
+
+class BackupRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'pyiosbackup'
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+    def _handle(self, send_body: bool):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        try:
+            if path in ('/', DOMAINS_PREFIX):
+                self._send_listing([{'name': domain, 'kind': 'dir', 'href': _domain_href(domain, '')}
+                                    for domain in self.server.get_domains()], send_body)
+            elif path.startswith(DOMAINS_PREFIX):
+                domain, _, relative_path = path[len(DOMAINS_PREFIX):].partition('/')
+                self._handle_domain_path(domain, relative_path.rstrip('/'), send_body)
+            elif path.startswith(IDS_PREFIX):
+                with self.server.lock:
+                    entry = self.server.backup.get_entry_by_id(path[len(IDS_PREFIX):])
+                self._handle_entry(entry, send_body)
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+        except MissingEntryError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f'{self.address_string()} disconnected')
+
+    def _handle_domain_path(self, domain: str, relative_path: str, send_body: bool):
+        if not relative_path:
+            # Domains roots don't always have entries of their own.
+            if domain not in self.server.get_domains():
+                raise MissingEntryError()
+            self._send_children(domain, '', send_body)
+            return
+        with self.server.lock:
+            entry = self.server.backup.get_entry_by_domain_and_path(domain, relative_path)
+        self._handle_entry(entry, send_body)
+
+    def _handle_entry(self, entry, send_body: bool):
+        if entry.is_dir():
+            self._send_children(entry.domain, entry.relative_path, send_body)
+        elif entry.is_symlink():
+            self._redirect_symlink(entry)
+        else:
+            self._send_file(entry, send_body)
+
+    def _send_children(self, domain: str, relative_path: str, send_body: bool):
+        with self.server.lock:
+            items = [{
+                'name': posixpath.basename(child.relative_path.rstrip('/')),
+                'kind': 'dir' if child.is_dir() else 'symlink' if child.is_symlink() else 'file',
+                'href': _domain_href(domain, child.relative_path, child.is_dir()),
+                'file_id': child.file_id,
+                'size': child.size,
+                'last_modified': child.last_modified.isoformat(),
+            } for child in self.server.backup.iter_children(domain, relative_path)]
+        items.sort(key=lambda item: item['name'])
+        self._send_listing(items, send_body)
+
+    def _send_listing(self, items, send_body: bool):
+        if 'application/json' in self.headers.get('Accept', ''):
+            body = json.dumps(items).encode()
+            content_type = 'application/json'
+        else:
+            title = html.escape(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path))
+            links = ''.join(
+                f'<li><a href="{html.escape(item["href"])}">{html.escape(item["name"])}'
+                f'{"/" if item["kind"] == "dir" else ""}</a></li>\n'
+                for item in items
+            )
+            body = f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title></head>\n' \
+                   f'<body><h1>{title}</h1><ul>\n{links}</ul></body></html>\n'.encode()
+            content_type = 'text/html; charset=utf-8'
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _redirect_symlink(self, entry):
+        target = entry.link_target
+        if target.startswith('/'):
+            # Absolute targets refer to the device's filesystem, which is not mapped to domains.
+            raise MissingEntryError()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(entry.relative_path.rstrip('/')), target))
+        if target == '..' or target.startswith('../'):
+            raise MissingEntryError()
+        self.send_response(HTTPStatus.FOUND)
+        self.send_header('Location', _domain_href(entry.domain, '' if target == '.' else target))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_file(self, entry, send_body: bool):
+        # File IDs are hashes of the domain and path, so the modification time and size tell apart the contents the
+        # same entry had in different backups.
+        etag = f'"{entry.file_id}-{int(entry.last_modified.timestamp())}-{entry.size}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        data = self._open_entry(entry)
+        if data is None:
+            return
+        with data:
+            size = data.seek(0, io.SEEK_END)
+            requested_range = self.headers.get('Range')
+            if requested_range is not None and self.headers.get('If-Range', etag) != etag:
+                requested_range = None
+            content_range = _parse_range(requested_range, size) if requested_range is not None else (0, size)
+            if content_range is None:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = content_range
+            if (start, end) == (0, size):
+                self.send_response(HTTPStatus.OK)
+            else:
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+            content_type, _ = mimetypes.guess_type(entry.relative_path)
+            self.send_header('Content-Type', content_type or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', formatdate(entry.last_modified.timestamp(), usegmt=True))
+            self.end_headers()
+            if send_body:
+                # Only the blocks covering the requested range are decrypted.
+                data.seek(start)
+                remaining = end - start
+                while remaining:
+                    chunk = data.read(min(remaining, COPY_BUFFER_SIZE))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    def _open_entry(self, entry):
+        """
+        Open the decrypted content of an entry, sending an error instead for missing or corrupted entries.
+        :return: Decrypted file object, None if an error was sent.
+        """
+        try:
+            return entry.open()
+        except FileNotFoundError:
+            logger.warning(f'Stored file of {entry.relative_path} is missing')
+            self.send_error(HTTPStatus.NOT_FOUND, 'Missing stored file')
+        except (OSError, ValueError):
+            logger.warning(f'Could not serve content for {entry.relative_path}')
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, 'Corrupted entry')
+        return None
+
+
+def _parse_range(requested_range: str, size: int):
+    """
+    Parse a Range header.
+    :param requested_range: Value of the header, e.g. 'bytes=100-199'.
+    :param size: Size of the entry.
+    :return: Start and end offsets of the range, the whole entry for headers that are not a single bytes range, None
+    for ranges that can't be satisfied.
+    """
+    match = range_regex.match(requested_range.strip())
+    if match is None or match.groups() == ('', ''):
+        return 0, size
+    first, last = match.groups()
+    if not first:
+        # Suffix ranges request the last bytes of the entry.
+        return (max(size - int(last), 0), size) if int(last) and size else None
+    if int(first) >= size or (last and int(last) < int(first)):
+        return None
+    return int(first), min(int(last) + 1, size) if last else size
+
+
+def _domain_href(domain: str, relative_path: str, is_dir: bool = False) -> str:
+    href = f'{DOMAINS_PREFIX}{urllib.parse.quote(domain)}/{urllib.parse.quote(relative_path.rstrip("/"))}'
+    return f'{href}/' if is_dir and relative_path else href
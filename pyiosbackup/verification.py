@@ -0,0 +1,161 @@
+import os
+import re
+import shutil
+from enum import Enum
+from typing import Optional
+
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+
+from pyiosbackup.content_store import HashingWriter
+from pyiosbackup.entry_file import BLOCK_SIZE, CHUNK_SIZE, decrypt_entry_to_file, plaintext_size
+
+file_id_regex = re.compile(r'[0-9a-f]{40}$')
+hash_directory_regex = re.compile(r'[0-9a-f]{2}$')
+
+
+class Problem(Enum):
+    MISSING = 'missing'
+    SIZE_MISMATCH = 'size_mismatch'
+    MISALIGNED = 'misaligned'
+    BAD_KEY = 'bad_key'
+    BAD_PADDING = 'bad_padding'
+    DIGEST_MISMATCH = 'digest_mismatch'
+    ORPHANED = 'orphaned'
+
+
+def problem_report(file_id: str, domain: Optional[str], relative_path: Optional[str], problem: Problem,
+                   detail: str):
+    """
+    Create a report of a problem found in a backup.
+    :param file_id: ID of the entry or of the stored file.
+    :param domain: Entry's domain, None for stored files without an entry.
+    :param relative_path: Entry's relative path, None for stored files without an entry.
+    :param problem: Problem found.
+    :param detail: Description of the problem.
+    :rtype: dict
+    """
+    return {'file_id': file_id, 'domain': domain, 'relative_path': relative_path, 'problem': problem.value,
+            'detail': detail}
+
+
+def encrypted_sizes(size: int):
+    """
+    Get the sizes an encrypted entry file may have.
+    :param size: Size of the decrypted data.
+    :return: Allowed encrypted sizes, PKCS7 padding always adds between 1 and 16 bytes. Empty entries may also be
+    stored as empty files.
+    :rtype: tuple
+    """
+    padded_size = size + BLOCK_SIZE - size % BLOCK_SIZE
+    return (0, padded_size) if not size else (padded_size,)
+
+
+def scan_stored_files(path, hash_directories: bool):
+    """
+    Get the sizes of all entry files stored in a backup, listing every directory once instead of looking up each file.
+    :param path: Path to the backup directory.
+    :param hash_directories: Whether files are kept in directories named by their IDs first byte.
+    :return: Mapping between stored files names, i.e. entries IDs, and their sizes.
+    :rtype: dict
+    """
+    sizes = {}
+    with os.scandir(path) as entries:
+        for dir_entry in entries:
+            if hash_directories:
+                if hash_directory_regex.match(dir_entry.name) and dir_entry.is_dir(follow_symlinks=False):
+                    with os.scandir(dir_entry.path) as files:
+                        sizes.update((file.name, file.stat().st_size) for file in files if file.is_file())
+            elif file_id_regex.match(dir_entry.name) and dir_entry.is_file():
+                sizes[dir_entry.name] = dir_entry.stat().st_size
+    return sizes
+
+
+def check_stored_size(entry, stored_size: int):
+    """
+    Check the size of an entry's stored file against the entry's size.
+    :param entry: File entry to check.
+    :param stored_size: Size of the stored file.
+    :return: The problem found and its details, None for valid sizes.
+    :rtype: tuple
+    """
+    encrypted = entry.backup.is_encrypted
+    if encrypted and stored_size % BLOCK_SIZE:
+        return Problem.MISALIGNED, f'stored size {stored_size} is not a multiple of {BLOCK_SIZE}'
+    expected_sizes = encrypted_sizes(entry.size) if encrypted else (entry.size,)
+    if stored_size not in expected_sizes:
+        return Problem.SIZE_MISMATCH, f'stored size {stored_size}, expected {expected_sizes[-1]}'
+    return None
+
+
+def hash_entry_file(path, key: Optional[bytes], chunk_size: int = CHUNK_SIZE):
+    """
+    Hash the decrypted data of an entry file.
+    :param path: Path to the entry file.
+    :param key: Unwrapped AES key of the entry, None to hash the data as stored.
+    :param chunk_size: Amount of data to read at once.
+    :return: Decrypted data size and its SHA-1 digest.
+    :rtype: tuple
+    """
+    writer = HashingWriter(algorithm='sha1')
+    if key is not None:
+        size = decrypt_entry_to_file(path, key, writer, chunk_size)
+    else:
+        with open(path, 'rb') as file:
+            shutil.copyfileobj(file, writer, chunk_size)
+            size = file.tell()
+    return size, writer.hash.digest()
+
+
+def verify_entry(entry):
+    """
+    Verify the data of a file entry, without writing it anywhere.
+    The stored size is checked against the entry's size and the cipher block size, and the padding against the
+    decrypted size. Entries with a digest, only recorded by Manifest.mbdb, are also hashed in full.
+    :param entry: File entry to verify.
+    :return: The problem found and its details, None for valid entries.
+    :rtype: tuple
+    """
+    try:
+        stored_size = os.stat(entry.real_path).st_size
+    except FileNotFoundError:
+        return Problem.MISSING, f'{entry.hash_path} does not exist'
+    problem = check_stored_size(entry, stored_size)
+    if problem is not None:
+        return problem
+    key = None
+    if entry.backup.is_encrypted:
+        try:
+            key = entry.backup.keybag.unwrap_key(entry.encryption_key)
+        except (InvalidUnwrap, KeyError, ValueError) as e:
+            return Problem.BAD_KEY, f'could not unwrap key: {e!r}'
+    try:
+        return check_stored_data(entry, stored_size, key)
+    except ValueError:
+        return Problem.BAD_PADDING, 'invalid padding of the last block'
+
+
+def check_stored_data(entry, stored_size: int, key: Optional[bytes]):
+    """
+    Check the decrypted size of an entry's stored file, and its digest if the entry has one.
+    :param entry: File entry to check.
+    :param stored_size: Size of the stored file.
+    :param key: Unwrapped AES key of the entry, None for unencrypted backups.
+    :return: The problem found and its details, None for valid data.
+    :rtype: tuple
+    :raises ValueError: The padding of the last block is invalid.
+    """
+    if entry.digest:
+        size, digest = hash_entry_file(entry.real_path, key)
+    elif key is not None:
+        with open(entry.real_path, 'rb') as file:
+            size = plaintext_size(file, stored_size, key)
+    else:
+        return None
+    if size != entry.size:
+        return Problem.SIZE_MISMATCH, f'decrypted size {size}, expected {entry.size}'
+    if entry.digest and entry.digest != digest:
+        # Digests of encrypted entries may cover their stored data rather than their decrypted data, so the stored data
+        # is hashed as well, though only after a mismatch.
+        if key is None or hash_entry_file(entry.real_path, None)[1] != entry.digest:
+            return Problem.DIGEST_MISMATCH, f'digest {digest.hex()}, expected {entry.digest.hex()}'
+    return None
@@ -1,5 +1,14 @@
+import plistlib
+import sqlite3
+from pathlib import Path
+from plistlib import UID
+
 from pytest import fixture
 
+from pyiosbackup import Backup
+from pyiosbackup.manifest_dbs.sqlite3 import ManifestDbSqlite3
+from pyiosbackup.manifest_plist import ManifestPlist
+
 MANIFEST_KEYBAG_ZEROS = (
     # Version
     b'VERS'
@@ -472,3 +481,67 @@ def manifest_keybag_zeros():
 @fixture
 def manifest_keybag_zeros_before_10_2():
     return MANIFEST_KEYBAG_ZEROS_BEFORE_10_2
+
+
+def archived_mbfile(relative_path: str, extended_attributes: bool = False, class_name: str = 'MBFile',
+                    mode: int = 33188, size: int = 2 ** 33, last_modified: int = 1628082463,
+                    link_target: str = '') -> bytes:
+    objects = [
+        '$null',
+        {'$class': UID(2), 'Birth': 1627974948, 'EncryptionKey': UID(4), 'Flags': 0, 'GroupID': 501,
+         'InodeNumber': 2 ** 40, 'LastModified': last_modified, 'LastStatusChange': 1628082509, 'Mode': mode,
+         'ProtectionClass': 3, 'RelativePath': UID(3), 'Size': size, 'UserID': 501},
+        {'$classes': [class_name, 'NSObject'], '$classname': class_name},
+        relative_path,
+        {'$class': UID(5), 'NS.data': UID(6)},
+        {'$classes': ['NSMutableData', 'NSData', 'NSObject'], '$classname': 'NSMutableData'},
+        b'\x03\x00\x00\x00' + b'\x11' * 40,
+    ]
+    if extended_attributes:
+        objects[1]['ExtendedAttributes'] = UID(7)
+        objects.append(b'bplist00')
+    if link_target:
+        objects[1]['Target'] = UID(len(objects))
+        objects.append(link_target)
+    return plistlib.dumps({'$archiver': 'NSKeyedArchiver', '$objects': objects, '$top': {'root': UID(1)},
+                           '$version': 100000}, fmt=plistlib.FMT_BINARY)
+
+
+@fixture
+def archive_mbfile():
+    return archived_mbfile
+
+
+def files_db(rows, path=':memory:') -> sqlite3.Connection:
+    """
+    Create a Manifest.db `Files` table.
+    :param rows: (file ID, domain, relative path, flags, archived MBFile) tuples.
+    :param path: Path to the database, in memory by default.
+    """
+    conn = sqlite3.connect(str(path), check_same_thread=False)
+    conn.execute('CREATE TABLE Files (fileID text, domain text, relativePath text, flags integer, file blob)')
+    conn.executemany('INSERT INTO Files VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    return conn
+
+
+def unencrypted_backup(rows, path=Path('.'), product_version: str = '14.0') -> Backup:
+    """
+    Create an unencrypted backup whose Manifest.db is kept in memory.
+    :param rows: Manifest.db rows, as taken by `files_db`.
+    :param path: Path to the backup directory, holding the stored files.
+    :param product_version: iOS version of the backup.
+    """
+    manifest_plist = ManifestPlist({'IsEncrypted': False, 'Lockdown': {'ProductVersion': product_version}})
+    return Backup(Path(path), ManifestDbSqlite3(Path(ManifestDbSqlite3.NAME), files_db(rows)), manifest_plist, {}, {},
+                  None)
+
+
+@fixture
+def make_files_db():
+    return files_db
+
+
+@fixture
+def make_backup():
+    return unencrypted_backup
@@ -1,4 +1,11 @@
+import gc
+import hashlib
+import io
 import plistlib
+import sqlite3
+import stat
+import tarfile
+import zipfile
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -6,7 +13,13 @@ import pytest
 
 from pyiosbackup import Backup
 from pyiosbackup.backup import INFO_PLIST_PATH, STATUS_PLIST_PATH
-from pyiosbackup.exceptions import BackupPasswordIsRequired, MissingEntryError
+from pyiosbackup.content_store import ContentStore
+from pyiosbackup.entry import Entry
+from pyiosbackup.exceptions import BackupPasswordIsRequired, CorruptedEntryError, MissingEntryError
+from pyiosbackup.extraction_journal import ExtractionJournal
+from pyiosbackup.keybag import Keybag
+from pyiosbackup.manifest_cache import ManifestCache
+from pyiosbackup.manifest_dbs import sqlite3 as manifest_db_sqlite3
 from pyiosbackup.manifest_dbs.mbdb import ManifestDbMbdb
 from pyiosbackup.manifest_dbs.sqlite3 import ManifestDbSqlite3
 from pyiosbackup.manifest_plist import ManifestPlist
@@ -51,6 +64,375 @@ def test_creating_from_path_sqlite3(backup):
     assert file.read_text() == 'Test data'
 
 
+@pytest.mark.parametrize('workers', [1, 4])
+def test_unback(backup, tmp_path_factory, workers):
+    b = Backup.from_path(backup, '0000')
+    target = tmp_path_factory.mktemp('target')
+    b.unback(target, workers=workers)
+    assert (target / 'MyTestDomain' / 'Media' / 'Test.txt').read_text() == 'Test data'
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_unback_corrupted_entry(backup, tmp_path_factory, workers):
+    (backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').write_bytes(b'\x00' * 16)
+    b = Backup.from_path(backup, '0000')
+    target = tmp_path_factory.mktemp('target')
+    b.unback(target, workers=workers)
+    assert not (target / 'MyTestDomain' / 'Media' / 'Test.txt').exists()
+    with pytest.raises(CorruptedEntryError):
+        b.unback(target, strict=True, workers=workers)
+    # Files already extracted are kept.
+    (target / 'MyTestDomain' / 'Media' / 'Test.txt').write_text('Old data')
+    b.unback(target, workers=workers)
+    assert [path.name for path in (target / 'MyTestDomain' / 'Media').iterdir()] == ['Test.txt']
+    assert (target / 'MyTestDomain' / 'Media' / 'Test.txt').read_text() == 'Old data'
+
+
+def test_unback_missing_entry(backup, tmp_path_factory):
+    (backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').unlink()
+    b = Backup.from_path(backup, '0000')
+    target = tmp_path_factory.mktemp('target')
+    with pytest.raises(FileNotFoundError):
+        b.unback(target)
+    assert list((target / 'MyTestDomain' / 'Media').iterdir()) == []
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_unback_resume(backup, tmp_path_factory, monkeypatch, workers):
+    b = Backup.from_path(backup, '0000')
+    target = tmp_path_factory.mktemp('target')
+    saved = []
+    save = Entry.save
+
+    def save_spy(entry, path):
+        saved.append(entry.relative_path)
+        return save(entry, path)
+
+    monkeypatch.setattr(Entry, 'save', save_spy)
+    b.unback(target, workers=workers, resume=True)
+    assert (target / ExtractionJournal.NAME).exists()
+    b.unback(target, workers=workers, resume=True)
+    assert saved == ['Media/Test.txt']
+    (target / 'MyTestDomain' / 'Media' / 'Test.txt').write_text('Changed')
+    b.unback(target, workers=workers, resume=True)
+    assert saved == ['Media/Test.txt', 'Media/Test.txt']
+    assert (target / 'MyTestDomain' / 'Media' / 'Test.txt').read_text() == 'Test data'
+
+
+def test_diff(make_backup, archive_mbfile):
+    def backup_of(files):
+        return make_backup([(f'{i:040x}', domain, relative_path, 1, archive_mbfile(relative_path, size=size))
+                            for i, (domain, relative_path, size) in enumerate(files)])
+
+    old = backup_of([('HomeDomain', 'a', 1), ('HomeDomain', 'b', 1), ('RootDomain', 'c', 1), ('HomeDomain', 'e', 1)])
+    new = backup_of([('RootDomain', 'd', 1), ('HomeDomain', 'b', 2), ('HomeDomain', 'a', 1), ('HomeDomain', 'e', 1)])
+    changes = [(change, None if entry is None else entry.relative_path, None if other is None else other.size)
+               for change, entry, other in old.diff(new)]
+    assert changes == [('modified', 'b', 2), ('removed', 'c', None), ('added', None, 1)]
+    assert list(old.diff(old)) == []
+
+
+def test_unback_delta(tmp_path, make_backup, archive_mbfile):
+    backup_path = tmp_path / 'backup'
+    rows = {}
+
+    def put(file_id, relative_path, data, last_modified=0):
+        (backup_path / file_id[:2]).mkdir(parents=True, exist_ok=True)
+        (backup_path / file_id[:2] / file_id).write_bytes(data)
+        rows[file_id] = (file_id, 'HomeDomain', relative_path, 1,
+                         archive_mbfile(relative_path, size=len(data), last_modified=last_modified))
+
+    put('aa' * 20, 'a.txt', b'a')
+    put('bb' * 20, 'b.txt', b'b')
+    put('cc' * 20, 'c.txt', b'c')
+    target = tmp_path / 'target'
+    make_backup(rows.values(), backup_path).unback(target, resume=True)
+
+    put('bb' * 20, 'b.txt', b'b2', last_modified=1)
+    del rows['cc' * 20]
+    put('dd' * 20, 'd.txt', b'd')
+    b = make_backup(rows.values(), backup_path)
+    assert b.unback_delta(target) == {
+        'added': [('HomeDomain', 'd.txt')],
+        'modified': [('HomeDomain', 'b.txt')],
+        'removed': [('HomeDomain', 'c.txt')],
+        'unchanged': 1,
+    }
+    assert sorted(path.name for path in (target / 'HomeDomain').iterdir()) == ['a.txt', 'b.txt', 'd.txt']
+    assert (target / 'HomeDomain' / 'b.txt').read_bytes() == b'b2'
+    assert b.unback_delta(target) == {'added': [], 'modified': [], 'removed': [], 'unchanged': 3}
+
+
+class _Pipe(io.RawIOBase):
+    """ Write-only stream that can't seek, like stdout redirected to a pipe. """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+@pytest.fixture
+def export_backup(tmp_path, make_backup, archive_mbfile):
+    (tmp_path / 'bb').mkdir()
+    (tmp_path / 'bb' / ('bb' * 20)).write_bytes(b'Test data')
+    return make_backup([
+        ('aa' * 20, 'HomeDomain', 'Library', 1, archive_mbfile('Library', mode=0o40755, size=0)),
+        ('bb' * 20, 'HomeDomain', 'Library/a.txt', 1, archive_mbfile('Library/a.txt', mode=0o100600, size=9)),
+        ('cc' * 20, 'HomeDomain', 'Library/link', 1,
+         archive_mbfile('Library/link', mode=0o120755, size=0, link_target='a.txt')),
+    ], tmp_path)
+
+
+def test_export_tar(export_backup):
+    pipe = _Pipe()
+    export_backup.export_tar(pipe)
+    with tarfile.open(fileobj=io.BytesIO(pipe.data)) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+        assert sorted(members) == ['HomeDomain/Library', 'HomeDomain/Library/a.txt', 'HomeDomain/Library/link']
+        assert members['HomeDomain/Library'].isdir()
+        assert members['HomeDomain/Library'].mode == 0o755
+        file = members['HomeDomain/Library/a.txt']
+        assert (file.mode, file.uid, file.gid, file.mtime) == (0o600, 501, 501, 1628082463)
+        assert tar.extractfile(file).read() == b'Test data'
+        assert members['HomeDomain/Library/link'].issym()
+        assert members['HomeDomain/Library/link'].linkname == 'a.txt'
+
+
+def test_export_zip(export_backup):
+    pipe = _Pipe()
+    export_backup.export_zip(pipe, compression=zipfile.ZIP_DEFLATED)
+    with zipfile.ZipFile(io.BytesIO(pipe.data)) as archive:
+        infos = {info.filename: info for info in archive.infolist()}
+        assert sorted(infos) == ['HomeDomain/Library/', 'HomeDomain/Library/a.txt', 'HomeDomain/Library/link']
+        assert infos['HomeDomain/Library/'].is_dir()
+        assert archive.read('HomeDomain/Library/a.txt') == b'Test data'
+        assert infos['HomeDomain/Library/a.txt'].external_attr >> 16 == 0o100600
+        assert stat.S_ISLNK(infos['HomeDomain/Library/link'].external_attr >> 16)
+        assert archive.read('HomeDomain/Library/link') == b'a.txt'
+
+
+def test_export_corrupted_entry(backup):
+    (backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').write_bytes(b'\x00' * 16)
+    b = Backup.from_path(backup, '0000')
+    output = io.BytesIO()
+    b.export_tar(output)
+    with tarfile.open(fileobj=io.BytesIO(output.getvalue())) as tar:
+        assert tar.getnames() == []
+    with pytest.raises(CorruptedEntryError):
+        b.export_zip(io.BytesIO(), strict=True)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_search(backup, workers):
+    b = Backup.from_path(backup, '0000')
+    assert [(entry.relative_path, offset) for entry, offset in b.search('data', workers=workers)] == [
+        ('Media/Test.txt', 5)
+    ]
+    assert list(b.search(b'missing', workers=workers)) == []
+    assert list(b.search('data', domains=['HomeDomain'], workers=workers)) == []
+    assert list(b.search('data', max_size=8, workers=workers)) == []
+    assert list(b.search('data', skip_suffixes=['.TXT'], workers=workers)) == []
+    (backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').write_bytes(b'\x00' * 16)
+    assert list(b.search('data', workers=workers)) == []
+    with pytest.raises(CorruptedEntryError):
+        list(b.search('data', workers=workers, strict=True))
+    (backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').unlink()
+    assert list(b.search('data', workers=workers)) == []
+    with pytest.raises(FileNotFoundError):
+        list(b.search('data', workers=workers, strict=True))
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_verify(backup, workers):
+    b = Backup.from_path(backup, '0000')
+    assert b.verify(workers) == {'checked': 1, 'problems': []}
+    path = backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc'
+    for data, problem in [(b'\x00' * 32, 'size_mismatch'), (b'\x00' * 15, 'misaligned'), (b'\x00' * 16, 'bad_padding')]:
+        path.write_bytes(data)
+        assert [(p['file_id'], p['problem']) for p in b.verify(workers)['problems']] == [
+            ('5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc', problem)
+        ]
+    path.unlink()
+    assert [p['problem'] for p in b.verify(workers)['problems']] == ['missing']
+
+
+def test_quick_check(backup):
+    b = Backup.from_path(backup, '0000')
+    assert b.quick_check() == {'checked': 1, 'problems': []}
+    (backup / '57' / ('57' * 20)).write_bytes(b'\x00' * 16)
+    (backup / 'not-a-hash-directory').mkdir()
+    (backup / 'not-a-hash-directory' / ('58' * 20)).write_bytes(b'\x00' * 16)
+    path = backup / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc'
+    path.write_bytes(b'\x00' * 32)
+    assert [(p['file_id'], p['problem']) for p in b.quick_check()['problems']] == [
+        ('5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc', 'size_mismatch'), ('57' * 20, 'orphaned')
+    ]
+    path.unlink()
+    assert [p['problem'] for p in b.quick_check()['problems']] == ['missing', 'orphaned']
+
+
+def test_unback_to_content_store(backup, tmp_path_factory):
+    b = Backup.from_path(backup, '0000')
+    store_path = tmp_path_factory.mktemp('store')
+    targets = [tmp_path_factory.mktemp('target'), tmp_path_factory.mktemp('target')]
+    with ContentStore(store_path) as store:
+        for target in targets:
+            b.unback(target, store=store)
+    files = [target / 'MyTestDomain' / 'Media' / 'Test.txt' for target in targets]
+    assert [file.read_text() for file in files] == ['Test data', 'Test data']
+    assert files[0].stat().st_ino == files[1].stat().st_ino
+    b.unback(targets[0])
+    assert files[0].read_text() == 'Test data'
+    assert files[0].stat().st_ino != files[1].stat().st_ino
+
+
+@pytest.mark.parametrize('supports_deserialize', [False, manifest_db_sqlite3.SUPPORTS_DESERIALIZE])
+def test_extract_all(backup, tmp_path_factory, monkeypatch, supports_deserialize):
+    monkeypatch.setattr(manifest_db_sqlite3, 'SUPPORTS_DESERIALIZE', supports_deserialize)
+    target = tmp_path_factory.mktemp('target')
+    with Backup.from_path(backup, '0000') as b:
+        temporary_path = b._manifest_db._temporary_path
+        assert (temporary_path is None) == supports_deserialize
+        b.extract_all(target)
+    assert temporary_path is None or not temporary_path.exists()
+    assert (target / '57' / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').read_text() == 'Test data'
+    conn = sqlite3.connect(str(target / ManifestDbSqlite3.NAME))
+    assert conn.execute('SELECT relativePath FROM Files').fetchall() == [('Media/Test.txt',)]
+    conn.close()
+
+
+def test_temporary_manifest_removed_without_close(backup, monkeypatch):
+    monkeypatch.setattr(manifest_db_sqlite3, 'SUPPORTS_DESERIALIZE', False)
+    b = Backup.from_path(backup, '0000')
+    temporary_path = b._manifest_db._temporary_path
+    assert temporary_path.exists()
+    del b
+    gc.collect()
+    assert not temporary_path.exists()
+
+
+def test_manifest_cache(backup, tmp_path_factory, monkeypatch):
+    cache_path = tmp_path_factory.mktemp('cache')
+    manifest_cache = ManifestCache(cache_path)
+    with Backup.from_path(backup, '0000', manifest_cache=manifest_cache) as b:
+        assert len(list(b.iter_files())) == 1
+    cached_path, = cache_path.glob('*.sqlite3')
+    conn = sqlite3.connect(str(cached_path))
+    assert 'FilesDomainRelativePathIdx' in [index[1] for index in conn.execute('PRAGMA index_list(Files)')]
+    conn.close()
+
+    def decrypt(*args, **kwargs):
+        raise AssertionError('Manifest.db should be loaded from cache')
+
+    def ensure_domain_path_index(path):
+        raise AssertionError('Cached Manifest.db should not be modified')
+
+    monkeypatch.setattr(Keybag, 'decrypt', decrypt)
+    monkeypatch.setattr(manifest_db_sqlite3, 'ensure_domain_path_index', ensure_domain_path_index)
+    with Backup.from_path(backup, '0000', manifest_cache=manifest_cache) as b:
+        assert [file.read_text() for file in b.iter_files()] == ['Test data']
+
+
+def test_lazy_entries(backup, monkeypatch):
+    b = Backup.from_path(backup, '0000')
+    decode_mbfile = manifest_db_sqlite3.decode_mbfile
+
+    def decode_mbfile_once(data):
+        monkeypatch.setattr(manifest_db_sqlite3, 'decode_mbfile', None)
+        return decode_mbfile(data)
+
+    monkeypatch.setattr(manifest_db_sqlite3, 'decode_mbfile', decode_mbfile_once)
+    entries = list(b.iter_entries(lazy=True))
+    assert [(entry.domain, entry.relative_path) for entry in entries] == [('MyTestDomain', 'Media/Test.txt')]
+    entry = entries[0]
+    assert entry.size == 9
+    assert entry.last_modified == datetime.fromtimestamp(1628082463, timezone.utc)
+    assert entry.read_text() == 'Test data'
+
+
+@pytest.fixture
+def tree_backup(make_backup, archive_mbfile):
+    return make_backup([
+        (f'{i:040x}', domain, relative_path, 0,
+         archive_mbfile(relative_path, mode=mode, link_target='../Documents/a.txt' if mode == 0o120755 else ''))
+        for i, (domain, relative_path, mode) in enumerate([
+            ('AppDomain-a', '', 0o40755),
+            ('AppDomain-a', 'Documents', 0o40755),
+            ('AppDomain-a', 'Documents/a.txt', 0o100644),
+            ('AppDomain-a', 'Documents/Inbox', 0o40755),
+            ('AppDomain-a', 'Documents/Inbox/b.txt', 0o100644),
+            ('AppDomain-a', 'Library', 0o40755),
+            ('AppDomain-a', 'Library/link', 0o120755),
+            ('AppDomain-b', 'Documents', 0o40755),
+            ('AppDomain-b', 'Documents/c.txt', 0o100644),
+        ])
+    ])
+
+
+def test_lazy_fields_with_defaults(tree_backup):
+    links = [entry for entry in tree_backup.iter_entries(lazy=True) if entry.relative_path == 'Library/link']
+    assert links[0].link_target == '../Documents/a.txt'
+    link, = tree_backup.get_entry_by_domain_and_path('AppDomain-a', 'Library').iterdir()
+    assert link.link_target == '../Documents/a.txt'
+    assert link.is_symlink()
+
+
+def test_walk(tree_backup):
+    assert [(path, [d.relative_path for d in dirs], [f.relative_path for f in files])
+            for path, dirs, files in tree_backup.walk('AppDomain-a')] == [
+        ('', ['Documents', 'Library'], []),
+        ('Documents', ['Documents/Inbox'], ['Documents/a.txt']),
+        ('Documents/Inbox', [], ['Documents/Inbox/b.txt']),
+        ('Library', [], ['Library/link']),
+    ]
+
+
+def test_walk_pruning(tree_backup):
+    walked = []
+    for path, dirs, _ in tree_backup.walk('AppDomain-a'):
+        walked.append(path)
+        dirs[:] = [d for d in dirs if d.relative_path != 'Documents']
+    assert walked == ['', 'Library']
+
+
+def test_iterdir_indexes_each_domain_once(tree_backup, monkeypatch):
+    get_all_entries = tree_backup._manifest_db.get_all_entries
+    scanned_domains = []
+
+    def get_all_entries_spy(**kwargs):
+        scanned_domains.append(kwargs['domain'])
+        return get_all_entries(**kwargs)
+
+    monkeypatch.setattr(tree_backup._manifest_db, 'get_all_entries', get_all_entries_spy)
+    documents = tree_backup.get_entry_by_domain_and_path('AppDomain-a', 'Documents')
+    assert [entry.relative_path for entry in documents.iterdir()] == ['Documents/Inbox', 'Documents/a.txt']
+    library = tree_backup.get_entry_by_domain_and_path('AppDomain-a', 'Library')
+    assert [entry.relative_path for entry in library.iterdir()] == ['Library/link']
+    assert scanned_domains == ['AppDomain-a']
+    assert sorted((entry.domain, entry.relative_path) for entry in documents.iterdir(enforce_domain=False)) == [
+        ('AppDomain-a', 'Documents/Inbox'), ('AppDomain-a', 'Documents/a.txt'), ('AppDomain-b', 'Documents/c.txt'),
+    ]
+    assert scanned_domains == ['AppDomain-a', None]
+    with pytest.raises(ValueError):
+        list(tree_backup.get_entry_by_domain_and_path('AppDomain-a', 'Documents/a.txt').iterdir())
+
+
+def test_batch_lookups(tree_backup):
+    entries = tree_backup.get_entries_by_domain_and_paths([('AppDomain-a', 'Documents/a.txt'), ('AppDomain-a', 'x')])
+    assert entries[('AppDomain-a', 'Documents/a.txt')].is_file()
+    assert entries[('AppDomain-a', 'x')] is None
+    file_id = entries[('AppDomain-a', 'Documents/a.txt')].file_id
+    entries = tree_backup.get_entries_by_ids([file_id, 'missing'])
+    assert entries[file_id].relative_path == 'Documents/a.txt'
+    assert entries['missing'] is None
+
+
 def test_missing_entry(backup):
     b = Backup.from_path(backup, '0000')
     with pytest.raises(MissingEntryError):
@@ -126,6 +508,34 @@ def test_creating_from_path_mbdb(tmp_path, manifest_keybag_zeros_before_10_2):
     assert file.read_text() == 'Test data'
 
 
+@pytest.mark.parametrize('digest, problems', [
+    (hashlib.sha1(b'Test data').digest(), []),
+    (hashlib.sha1(b'x\xb5\x1c\xa57L:\xd5u\x17B\x88h\x8c\xdaI').digest(), []),
+    (hashlib.sha1(b'Other data').digest(), ['digest_mismatch']),
+])
+def test_verify_mbdb_digest(tmp_path, manifest_keybag_zeros_before_10_2, digest, problems):
+    # Replace the empty hash, right before the encryption key.
+    mbdb = example_mbdb.replace(b'\xff\xff\x00\x2c', b'\x00\x14' + digest + b'\x00\x2c')
+    (tmp_path / ManifestDbMbdb.NAME).write_bytes(mbdb)
+    manifest_plist = tmp_path / ManifestPlist.NAME
+    manifest_plist.write_bytes(plistlib.dumps({
+        'BackupKeyBag': manifest_keybag_zeros_before_10_2,
+        'IsEncrypted': True,
+        'Lockdown': {'ProductVersion': '9.0.1'},
+    }))
+    (tmp_path / INFO_PLIST_PATH).write_bytes(plistlib.dumps({}))
+    (tmp_path / STATUS_PLIST_PATH).write_bytes(plistlib.dumps({}))
+    (tmp_path / '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').write_bytes(b'x\xb5\x1c\xa57L:\xd5u\x17B\x88h\x8c\xdaI')
+    b = Backup.from_path(tmp_path, '0000')
+    assert b.get_entry_by_id('5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc').digest == digest
+    lazy_entry, = b.iter_entries(lazy=True)
+    # Manifest.mbdb IDs are hashed along with the rest of the metadata.
+    assert 'file_id' not in vars(lazy_entry)
+    assert lazy_entry.digest == digest
+    assert lazy_entry.file_id == '5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc'
+    assert [p['problem'] for p in b.verify()['problems']] == problems
+
+
 def test_missing_entry_mbdb(tmp_path, manifest_keybag_zeros_before_10_2):
     (tmp_path / ManifestDbMbdb.NAME).write_bytes(example_mbdb)
     manifest_plist = tmp_path / ManifestPlist.NAME
@@ -0,0 +1,85 @@
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from pyiosbackup.content_store import ContentStore
+
+
+def make_entry(file_id, data, last_modified=0, device='device'):
+    entry = SimpleNamespace(file_id=file_id, relative_path=file_id, size=len(data),
+                            last_modified=datetime.fromtimestamp(last_modified, timezone.utc), writes=0,
+                            backup=SimpleNamespace(is_encrypted=False, target_identifier=device))
+
+    def write_to(file):
+        entry.writes += 1
+        file.write(data)
+
+    entry.write_to = write_to
+    return entry
+
+
+def test_deduplicating_content(tmp_path):
+    with ContentStore(tmp_path / 'store') as store:
+        first = make_entry('aa' * 20, b'data')
+        second = make_entry('bb' * 20, b'data')
+        assert store.add(first) == store.add(second)
+        object_path = store.add(first)
+        assert object_path.read_bytes() == b'data'
+        assert object_path.parent.parent == tmp_path / 'store' / 'objects'
+        assert first.writes == 1
+        assert not os.access(object_path, os.W_OK) or os.geteuid() == 0
+        assert list((tmp_path / 'store' / 'tmp').iterdir()) == []
+
+
+def test_changed_entries_are_stored_again(tmp_path):
+    with ContentStore(tmp_path / 'store') as store:
+        entry = make_entry('aa' * 20, b'data')
+        store.add(entry)
+        changed = make_entry('aa' * 20, b'other', last_modified=1)
+        assert store.add(changed).read_bytes() == b'other'
+    with ContentStore(tmp_path / 'store') as store:
+        store.add(entry)
+        assert entry.writes == 1
+
+
+def test_entries_of_different_devices(tmp_path):
+    with ContentStore(tmp_path / 'store') as store:
+        store.add(make_entry('aa' * 20, b'data'))
+        other_device = make_entry('aa' * 20, b'atad', device='other')
+        assert store.add(other_device).read_bytes() == b'atad'
+        assert other_device.writes == 1
+
+
+def test_encrypted_entries_are_told_apart_by_key(tmp_path):
+    with ContentStore(tmp_path / 'store') as store:
+        for key, data in ((b'\x01' * 44, b'data'), (b'\x02' * 44, b'atad')):
+            entry = make_entry('aa' * 20, data)
+            entry.backup.is_encrypted = True
+            entry.encryption_key = key
+            assert store.add(entry).read_bytes() == data
+
+
+def test_linking(tmp_path):
+    with ContentStore(tmp_path / 'store') as store:
+        entry = make_entry('aa' * 20, b'data')
+        dest = tmp_path / 'dest'
+        dest.write_bytes(b'old')
+        store.link(entry, dest)
+        assert dest.read_bytes() == b'data'
+        assert dest.stat().st_ino == store.add(entry).stat().st_ino
+
+
+def test_failed_writes(tmp_path):
+    def write_to(file):
+        file.write(b'partial')
+        raise ValueError()
+
+    with ContentStore(tmp_path / 'store') as store:
+        entry = make_entry('aa' * 20, b'')
+        entry.write_to = write_to
+        with pytest.raises(ValueError):
+            store.add(entry)
+        assert list((tmp_path / 'store' / 'tmp').iterdir()) == []
+        assert list((tmp_path / 'store' / 'objects').iterdir()) == []
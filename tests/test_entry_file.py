@@ -0,0 +1,97 @@
+import io
+
+import pytest
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from pyiosbackup.entry_file import DecryptedEntryFile, decrypt_entry_data, decrypt_entry_to_file
+
+KEY = bytes(range(32))
+
+
+def encrypt(data: bytes) -> bytes:
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(KEY), modes.CBC(b'\x00' * 16)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+@pytest.mark.parametrize('data', [b'', b'Test data', b'A' * 16, bytes(range(256)) * 40])
+def test_reading_in_chunks(tmp_path, data):
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(data))
+    with io.BufferedReader(DecryptedEntryFile(path, KEY, chunk_size=64)) as file:
+        assert file.read() == data
+
+
+def test_reading_small_reads(tmp_path):
+    data = bytes(range(256)) * 4
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(data))
+    with DecryptedEntryFile(path, KEY, chunk_size=32) as file:
+        assert b''.join(iter(lambda: file.read(7), b'')) == data
+
+
+def test_invalid_padding(tmp_path):
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(b'Test data')[:-16] + b'\x00' * 16)
+    with pytest.raises(ValueError):
+        with DecryptedEntryFile(path, KEY) as file:
+            file.read()
+
+
+def test_unaligned_data(tmp_path):
+    path = tmp_path / 'entry'
+    path.write_bytes(b'\x00' * 17)
+    with pytest.raises(ValueError):
+        DecryptedEntryFile(path, KEY)
+
+
+def test_size(tmp_path):
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(b'Test data'))
+    with DecryptedEntryFile(path, KEY) as file:
+        assert file.size == 9
+        assert file.seek(0, io.SEEK_END) == 9
+        assert file.read() == b''
+
+
+@pytest.mark.parametrize('offset', [0, 1, 15, 16, 17, 1000, 10230, 10240])
+def test_random_access(tmp_path, offset):
+    data = bytes(range(256)) * 40
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(data))
+    with io.BufferedReader(DecryptedEntryFile(path, KEY, chunk_size=64)) as file:
+        file.seek(offset)
+        assert file.read(100) == data[offset:offset + 100]
+        file.seek(offset // 2)
+        assert file.read(10) == data[offset // 2:offset // 2 + 10]
+
+
+@pytest.mark.parametrize('data', [b'', b'Test data', b'A' * 16, bytes(range(256)) * 40])
+def test_decrypt_entry_data(data):
+    assert decrypt_entry_data(encrypt(data), KEY) == data
+
+
+@pytest.mark.parametrize('encrypted', [encrypt(b'Test data')[:-16] + b'\x00' * 16, b'\x00' * 17])
+def test_decrypt_entry_data_invalid(encrypted):
+    with pytest.raises(ValueError):
+        decrypt_entry_data(encrypted, KEY)
+
+
+@pytest.mark.parametrize('data', [b'', b'Test data', b'A' * 16, b'A' * 63, bytes(range(256)) * 40])
+def test_decrypt_entry_to_file(tmp_path, data):
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypt(data))
+    dest = io.BytesIO()
+    assert decrypt_entry_to_file(path, KEY, dest, chunk_size=32) == len(data)
+    assert dest.getvalue() == data
+
+
+@pytest.mark.parametrize('encrypted', [encrypt(b'Test data')[:-16] + b'\x00' * 16, b'\x00' * 17])
+def test_decrypt_entry_to_file_invalid(tmp_path, encrypted):
+    path = tmp_path / 'entry'
+    path.write_bytes(encrypted)
+    dest = io.BytesIO()
+    with pytest.raises(ValueError):
+        decrypt_entry_to_file(path, KEY, dest)
+    assert dest.getvalue() == b''
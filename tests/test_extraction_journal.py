@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from pyiosbackup.extraction_journal import ExtractionJournal
+
+
+def make_entry(size=9, last_modified=1628082463):
+    return SimpleNamespace(file_id='5727bd1c5fa1055e15d8b4a75a74793c84b5ffdc', domain='MyTestDomain',
+                           relative_path='Media/Test.txt', size=size,
+                           last_modified=datetime.fromtimestamp(last_modified, timezone.utc))
+
+
+def test_extracted_entries(tmp_path):
+    dest = tmp_path / 'MyTestDomain' / 'Media' / 'Test.txt'
+    dest.parent.mkdir(parents=True)
+    dest.write_text('Test data')
+    with ExtractionJournal.from_directory(tmp_path) as journal:
+        assert not journal.is_extracted(make_entry(), dest)
+        journal.add(make_entry(), dest)
+        assert journal.is_extracted(make_entry(), dest)
+    with ExtractionJournal.from_directory(tmp_path) as journal:
+        assert journal.is_extracted(make_entry(), dest)
+        assert not journal.is_extracted(make_entry(size=10), dest)
+        assert not journal.is_extracted(make_entry(last_modified=0), dest)
+        assert not journal.is_extracted(make_entry(), tmp_path / 'Test.txt')
+        dest.write_text('Other data')
+        assert not journal.is_extracted(make_entry(), dest)
+        dest.unlink()
+        assert not journal.is_extracted(make_entry(), dest)
@@ -0,0 +1,38 @@
+import os
+import stat
+
+from pyiosbackup.key_cache import KeyCache
+
+
+def test_get_missing_key(tmp_path):
+    assert KeyCache(tmp_path / 'cache').get('fingerprint') is None
+
+
+def test_set_and_get_key(tmp_path):
+    cache = KeyCache(tmp_path / 'cache')
+    cache.set('fingerprint', b'\x01' * 32)
+    assert cache.get('fingerprint') == b'\x01' * 32
+    assert stat.S_IMODE((tmp_path / 'cache').stat().st_mode) == 0o700
+    assert stat.S_IMODE((tmp_path / 'cache' / 'fingerprint').stat().st_mode) == 0o600
+
+
+def test_set_restricts_existing_directory(tmp_path):
+    (tmp_path / 'cache').mkdir(mode=0o755)
+    os.chmod(tmp_path / 'cache', 0o755)
+    KeyCache(tmp_path / 'cache').set('fingerprint', b'\x01' * 32)
+    assert stat.S_IMODE((tmp_path / 'cache').stat().st_mode) == 0o700
+
+
+def test_expired_key(tmp_path):
+    cache = KeyCache(tmp_path / 'cache', ttl=60)
+    cache.set('fingerprint', b'\x01' * 32)
+    os.utime(tmp_path / 'cache' / 'fingerprint', (0, 0))
+    assert cache.get('fingerprint') is None
+    assert not (tmp_path / 'cache' / 'fingerprint').exists()
+
+
+def test_clear(tmp_path):
+    cache = KeyCache(tmp_path / 'cache')
+    cache.set('fingerprint', b'\x01' * 32)
+    cache.clear()
+    assert cache.get('fingerprint') is None
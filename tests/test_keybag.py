@@ -1,3 +1,11 @@
+import hashlib
+
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+
+import pytest
+
+from pyiosbackup.key_cache import KeyCache
+from pyiosbackup import keybag as keybag_module
 from pyiosbackup.keybag import Keybag
 from pyiosbackup.manifest_plist import ManifestPlist
 
@@ -20,3 +28,53 @@ def test_decrypting_data(manifest_keybag_zeros):
            b'\xe6Q&\xd0\xea\x13\x018\x1f\xb3\xa2\x94\x1e/')
     encrypted_data = b'x\xb5\x1c\xa57L:\xd5u\x17B\x88h\x8c\xdaI'
     assert keybag.decrypt(encrypted_data, key) == b'Test data\x07\x07\x07\x07\x07\x07\x07'
+
+
+@pytest.mark.parametrize('cache_size, expected_unwraps', [(0, 3), (16, 2)])
+def test_unwrapping_keys(monkeypatch, cache_size, expected_unwraps):
+    wrapping_key = bytes(range(32))
+    keybag = Keybag({3: wrapping_key}, unwrapped_keys_cache_size=cache_size)
+    first_key = (3).to_bytes(4, 'little') + aes_key_wrap(wrapping_key, b'\x01' * 32)
+    second_key = (3).to_bytes(4, 'little') + aes_key_wrap(wrapping_key, b'\x02' * 32)
+    unwraps = []
+    aes_key_unwrap = keybag_module.aes_key_unwrap
+
+    def aes_key_unwrap_spy(*args):
+        unwraps.append(args)
+        return aes_key_unwrap(*args)
+
+    monkeypatch.setattr(keybag_module, 'aes_key_unwrap', aes_key_unwrap_spy)
+    assert keybag.unwrap_key(first_key) == b'\x01' * 32
+    assert keybag.unwrap_key(second_key) == b'\x02' * 32
+    assert keybag.unwrap_key(first_key) == b'\x01' * 32
+    assert len(unwraps) == expected_unwraps
+
+
+def test_creating_from_manifest_with_key_cache(manifest_keybag_zeros, tmp_path, monkeypatch, caplog):
+    manifest = ManifestPlist({'BackupKeyBag': manifest_keybag_zeros, 'Lockdown': {'ProductVersion': '10.3'}})
+    key_cache = KeyCache(tmp_path)
+    Keybag.from_manifest(manifest, '0000', key_cache)
+
+    def pbkdf2_hmac(*args, **kwargs):
+        raise AssertionError('Key should be loaded from cache')
+
+    monkeypatch.setattr(hashlib, 'pbkdf2_hmac', pbkdf2_hmac)
+    keybag = Keybag.from_manifest(manifest, '1234', key_cache)
+    for i in range(1, 11):
+        assert keybag.get_key(i) == 32 * b'\x00'
+    assert 'password is not checked' in caplog.text
+    # The password isn't stored in any form, only the derived key.
+    assert all(b'0000' not in path.read_bytes() for path in tmp_path.iterdir())
+
+
+def test_invalid_cached_key(manifest_keybag_zeros, tmp_path):
+    manifest = ManifestPlist({'BackupKeyBag': manifest_keybag_zeros, 'Lockdown': {'ProductVersion': '10.3'}})
+    key_cache = KeyCache(tmp_path)
+    Keybag.from_manifest(manifest, '0000', key_cache)
+    [key_path] = tmp_path.iterdir()
+    key = key_path.read_bytes()
+    key_path.write_bytes(b'\x01' * 32)
+    keybag = Keybag.from_manifest(manifest, '0000', key_cache)
+    for i in range(1, 11):
+        assert keybag.get_key(i) == 32 * b'\x00'
+    assert key_path.read_bytes() == key
@@ -0,0 +1,78 @@
+import os
+import stat
+
+import pytest
+
+from pyiosbackup.manifest_cache import ManifestCache
+
+
+def test_fingerprint(tmp_path):
+    manifest_db = tmp_path / 'Manifest.db'
+    manifest_db.write_bytes(b'\x00' * 1024)
+    fingerprint = ManifestCache.fingerprint(manifest_db, b'key')
+    assert fingerprint == ManifestCache.fingerprint(manifest_db, b'key')
+    assert fingerprint != ManifestCache.fingerprint(manifest_db, b'other-key')
+    manifest_db.write_bytes(b'\x01' * 1024)
+    os.utime(manifest_db, ns=(0, 0))
+    assert fingerprint != ManifestCache.fingerprint(manifest_db, b'key')
+
+
+def test_put_and_get(tmp_path):
+    cache = ManifestCache(tmp_path / 'cache')
+    assert cache.get('fingerprint') is None
+    cached_path = cache.put('fingerprint', b'data')
+    assert cache.get('fingerprint') == cached_path
+    assert cached_path.read_bytes() == b'data'
+    assert stat.S_IMODE((tmp_path / 'cache').stat().st_mode) == 0o700
+    assert stat.S_IMODE(cached_path.stat().st_mode) == 0o600
+
+
+def test_put_prepares_before_caching(tmp_path):
+    cache = ManifestCache(tmp_path / 'cache')
+    prepared = []
+
+    def prepare(path):
+        assert cache.get('fingerprint') is None
+        path.write_bytes(path.read_bytes() + b' prepared')
+        prepared.append(path)
+
+    cached_path = cache.put('fingerprint', b'data', prepare=prepare)
+    assert cached_path.read_bytes() == b'data prepared'
+    assert prepared and prepared[0] != cached_path
+
+
+def test_put_failing_prepare(tmp_path):
+    def prepare(path):
+        raise ValueError()
+
+    cache = ManifestCache(tmp_path / 'cache')
+    with pytest.raises(ValueError):
+        cache.put('fingerprint', b'data', prepare=prepare)
+    assert list((tmp_path / 'cache').iterdir()) == []
+
+
+def test_put_restricts_existing_directory(tmp_path):
+    (tmp_path / 'cache').mkdir(mode=0o755)
+    os.chmod(tmp_path / 'cache', 0o755)
+    ManifestCache(tmp_path / 'cache').put('fingerprint', b'data')
+    assert stat.S_IMODE((tmp_path / 'cache').stat().st_mode) == 0o700
+
+
+def test_evicting_least_recently_used(tmp_path):
+    cache = ManifestCache(tmp_path / 'cache', max_bytes=20)
+    first = cache.put('first', b'\x00' * 10)
+    second = cache.put('second', b'\x00' * 10)
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    cache.get('first')
+    cache.put('third', b'\x00' * 10)
+    assert cache.get('first') is not None
+    assert cache.get('second') is None
+    assert cache.get('third') is not None
+
+
+def test_clear(tmp_path):
+    cache = ManifestCache(tmp_path / 'cache')
+    cache.put('fingerprint', b'data')
+    cache.clear()
+    assert cache.get('fingerprint') is None
@@ -0,0 +1,162 @@
+import hashlib
+import sqlite3
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from pyiosbackup.entry import EntryKind
+from pyiosbackup.exceptions import MissingEntryError
+from pyiosbackup.manifest_dbs import sqlite3 as manifest_db_sqlite3
+from pyiosbackup.manifest_dbs.mbdb import MBDB_HEADER, ManifestDbMbdb
+from pyiosbackup.manifest_dbs.sqlite3 import ManifestDbSqlite3, connect_read_only, ensure_domain_path_index
+
+DIR_MODE = 0o40755
+FILE_MODE = 0o100644
+SYMLINK_MODE = 0o120755
+
+ENTRIES = [
+    # Domain, relative path, flags, mode
+    ('RootDomain', '', 2, DIR_MODE),
+    ('RootDomain', 'Library', 2, DIR_MODE),
+    ('RootDomain', 'Library/Preferences', 2, DIR_MODE),
+    ('RootDomain', 'Library/Preferences/com.apple.backupd.plist', 1, FILE_MODE),
+    ('AppDomain-com.whatsapp', 'Documents', 2, DIR_MODE),
+    ('AppDomain-com.whatsapp', 'Documents/a.txt', 1, FILE_MODE),
+    ('AppDomain-com.whatsapp.share', 'Documents/b.txt', 0, FILE_MODE),
+    ('AppDomain-net.whatsapp', 'link', 4, SYMLINK_MODE),
+    ('AppDomain-*', 'Library/[weird]?.db', 1, FILE_MODE),
+    ('HomeDomain', 'Media/it\'s "quoted".jpg', 1, FILE_MODE),
+]
+
+
+def mbdb_string(value: bytes) -> bytes:
+    return struct.pack('>H', len(value)) + value if value else b'\xff\xff'
+
+
+def mbdb_record(domain: str, relative_path: str, mode: int, properties=()) -> bytes:
+    record = b''.join(mbdb_string(value) for value in (domain.encode(), relative_path.encode(), b'', b'', b''))
+    record += struct.pack('>HIIIIIIIQBB', mode, 0, 0, 501, 501, 0, 0, 0, 0, 0, len(properties))
+    return record + b''.join(mbdb_string(name) + mbdb_string(value) for name, value in properties)
+
+
+def file_id(domain: str, relative_path: str) -> str:
+    return hashlib.sha1(f'{domain}-{relative_path}'.encode()).hexdigest()
+
+
+@pytest.fixture(params=['sqlite3', 'mbdb'])
+def manifest_db(request, make_files_db, archive_mbfile):
+    if request.param == 'sqlite3':
+        return ManifestDbSqlite3(Path(ManifestDbSqlite3.NAME), make_files_db([
+            (file_id(domain, relative_path), domain, relative_path, flags, archive_mbfile(relative_path, mode=mode))
+            for domain, relative_path, flags, mode in ENTRIES
+        ]))
+    return ManifestDbMbdb(Path(ManifestDbMbdb.NAME), b''.join(
+        [MBDB_HEADER] + [mbdb_record(domain, relative_path, mode) for domain, relative_path, _, mode in ENTRIES]
+    ))
+
+
+def paths(entries):
+    return sorted((entry['domain'], entry['relative_path']) for entry in entries)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('filters, expected', [
+    ({}, [(domain, relative_path) for domain, relative_path, _, _ in ENTRIES]),
+    ({'domain': 'AppDomain-com.whatsapp'}, [('AppDomain-com.whatsapp', 'Documents'),
+                                            ('AppDomain-com.whatsapp', 'Documents/a.txt')]),
+    ({'domain_prefix': 'AppDomain-com.whatsapp'}, [('AppDomain-com.whatsapp', 'Documents'),
+                                                   ('AppDomain-com.whatsapp', 'Documents/a.txt'),
+                                                   ('AppDomain-com.whatsapp.share', 'Documents/b.txt')]),
+    ({'domain_prefix': 'AppDomain-*'}, [('AppDomain-*', 'Library/[weird]?.db')]),
+    ({'path_glob': 'Documents/*.txt'}, [('AppDomain-com.whatsapp', 'Documents/a.txt'),
+                                        ('AppDomain-com.whatsapp.share', 'Documents/b.txt')]),
+    ({'path_glob': 'Library/*'}, [('AppDomain-*', 'Library/[weird]?.db'),
+                                  ('RootDomain', 'Library/Preferences'),
+                                  ('RootDomain', 'Library/Preferences/com.apple.backupd.plist')]),
+    ({'kind': EntryKind.FILE, 'domain_prefix': 'AppDomain-'}, [('AppDomain-*', 'Library/[weird]?.db'),
+                                                               ('AppDomain-com.whatsapp', 'Documents/a.txt'),
+                                                               ('AppDomain-com.whatsapp.share', 'Documents/b.txt')]),
+    ({'kind': 'symlink'}, [('AppDomain-net.whatsapp', 'link')]),
+    ({'kind': EntryKind.DIRECTORY, 'domain': 'RootDomain'}, [('RootDomain', ''), ('RootDomain', 'Library'),
+                                                             ('RootDomain', 'Library/Preferences')]),
+])
+def test_filtering_entries(manifest_db, lazy, filters, expected):
+    assert paths(manifest_db.get_all_entries(lazy=lazy, **filters)) == sorted(expected)
+
+
+def test_batch_lookups(manifest_db):
+    plist_id = file_id('RootDomain', 'Library/Preferences/com.apple.backupd.plist')
+    by_ids = manifest_db.get_metadata_by_ids([plist_id, 'missing'])
+    assert by_ids[plist_id]['relative_path'] == 'Library/Preferences/com.apple.backupd.plist'
+    assert by_ids['missing'] is None
+    by_paths = manifest_db.get_metadata_by_domains_and_paths([('AppDomain-net.whatsapp', 'link'), ('RootDomain', 'x')])
+    assert by_paths[('AppDomain-net.whatsapp', 'link')]['file_id'] == file_id('AppDomain-net.whatsapp', 'link')
+    assert by_paths[('RootDomain', 'x')] is None
+
+
+def test_sorted_entries(manifest_db):
+    entries = list(manifest_db.get_sorted_entries())
+    keys = [(entry['domain'], entry['relative_path']) for entry in entries]
+    assert keys == sorted((domain, relative_path) for domain, relative_path, _, _ in ENTRIES)
+    assert entries[keys.index(('AppDomain-net.whatsapp', 'link'))]['load_metadata']()['mode'] == SYMLINK_MODE
+    assert len({entry['raw_metadata'] for entry in entries}) == len(ENTRIES)
+
+
+def test_domains(manifest_db):
+    assert manifest_db.get_domains() == sorted({domain for domain, _, _, _ in ENTRIES})
+
+
+def test_lookups_of_quoted_paths(manifest_db):
+    metadata = manifest_db.get_metadata_by_domain_and_path('HomeDomain', 'Media/it\'s "quoted".jpg')
+    assert metadata['file_id'] == file_id('HomeDomain', 'Media/it\'s "quoted".jpg')
+    assert manifest_db.get_metadata_by_id(metadata['file_id'])['relative_path'] == 'Media/it\'s "quoted".jpg'
+    with pytest.raises(MissingEntryError):
+        manifest_db.get_metadata_by_domain_and_path('HomeDomain', "x' OR '1'='1")
+
+
+def test_ensure_domain_path_index(tmp_path, make_files_db):
+    path = tmp_path / ManifestDbSqlite3.NAME
+    conn = make_files_db([], path)
+    conn.execute('CREATE INDEX FilesDomainIdx ON Files (domain)')
+    conn.close()
+    ensure_domain_path_index(path)
+    ensure_domain_path_index(path)
+    conn = connect_read_only(path)
+    assert sorted(index[1] for index in conn.execute('PRAGMA index_list(Files)')) == \
+        ['FilesDomainIdx', 'FilesDomainRelativePathIdx']
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute('DELETE FROM Files')
+
+
+def test_batch_lookups_chunks(monkeypatch, manifest_db):
+    monkeypatch.setattr(manifest_db_sqlite3, 'LOOKUP_CHUNK_SIZE', 2)
+    domains_and_paths = [(domain, relative_path) for domain, relative_path, _, _ in ENTRIES]
+    by_paths = manifest_db.get_metadata_by_domains_and_paths(domains_and_paths + [('RootDomain', 'x')])
+    assert [(metadata['domain'], metadata['relative_path']) for metadata in by_paths.values() if metadata] == \
+        domains_and_paths
+    by_ids = manifest_db.get_metadata_by_ids([file_id(*pair) for pair in domains_and_paths] + ['missing'] * 3)
+    assert len(by_ids) == len(ENTRIES) + 1
+    assert [metadata['file_id'] for metadata in by_ids.values() if metadata] == \
+        [file_id(*pair) for pair in domains_and_paths]
+
+
+def test_mbdb_records_with_properties():
+    data = MBDB_HEADER + mbdb_record('RootDomain', 'a', FILE_MODE, [(b'com.apple.x', b'\x00\x01')]) + \
+        mbdb_record('RootDomain', 'b', FILE_MODE)
+    manifest_db = ManifestDbMbdb(Path(ManifestDbMbdb.NAME), data)
+    assert paths(manifest_db.get_all_entries()) == [('RootDomain', 'a'), ('RootDomain', 'b')]
+    assert manifest_db.get_metadata_by_id(file_id('RootDomain', 'b'))['last_modified'] == \
+        datetime.fromtimestamp(0, timezone.utc)
+
+
+@pytest.mark.parametrize('data', [
+    b'mbdb\x04\x00',
+    MBDB_HEADER + mbdb_record('RootDomain', 'a', FILE_MODE)[:-1],
+    MBDB_HEADER + mbdb_record('RootDomain', 'a', FILE_MODE)[:-30],
+    MBDB_HEADER + b'\x00',
+])
+def test_mbdb_invalid_data(data):
+    with pytest.raises(ValueError):
+        ManifestDbMbdb(Path(ManifestDbMbdb.NAME), data)
@@ -0,0 +1,28 @@
+import pytest
+from bpylist2 import archiver
+
+from pyiosbackup.manifest_dbs.mbfile import MBFile, decode_mbfile
+
+
+@pytest.mark.parametrize('relative_path', ['Media/Test.txt', 'Media/בדיקה.txt', 'a' * 300])
+@pytest.mark.parametrize('extended_attributes', [False, True])
+def test_decode_like_archiver(archive_mbfile, relative_path, extended_attributes):
+    data = archive_mbfile(relative_path, extended_attributes)
+    mb_file = decode_mbfile(data)
+    assert mb_file == archiver.unarchive(data)
+    assert mb_file == MBFile(relative_path=relative_path, last_modified=1628082463, last_status_change=1628082509,
+                             created=1627974948, size=2 ** 33, mode=33188, group_id=501, user_id=501,
+                             encryption_key=b'\x03\x00\x00\x00' + b'\x11' * 40)
+
+
+def test_fallback_to_archiver(archive_mbfile, monkeypatch):
+    data = archive_mbfile('Media/Test.txt', class_name='MBFileV2')
+    monkeypatch.setitem(archiver.UNARCHIVE_CLASS_MAP, 'MBFileV2', MBFile)
+    assert decode_mbfile(data).relative_path == 'Media/Test.txt'
+
+
+def test_decode_link_target(archive_mbfile):
+    data = archive_mbfile('Library/link', mode=0o120755, link_target='../Documents')
+    mb_file = decode_mbfile(data)
+    assert mb_file.link_target == '../Documents'
+    assert mb_file == archiver.unarchive(data)
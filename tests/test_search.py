@@ -0,0 +1,31 @@
+import io
+import re
+
+import pytest
+
+from pyiosbackup.search import compile_pattern, search_file
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 4096])
+def test_search_file_across_chunks(chunk_size):
+    data = b'xx token yy token' + b'z' * 50 + b'token'
+    offsets = [match.start() for match in re.finditer(b'token', data)]
+    assert list(search_file(io.BytesIO(data), re.compile(b'token'), overlap=8, chunk_size=chunk_size)) == offsets
+
+
+def test_search_file_reports_matches_once():
+    data = b'aaaaaaaab' * 10
+    assert list(search_file(io.BytesIO(data), re.compile(b'a+'), overlap=10, chunk_size=16)) == list(range(0, 90, 9))
+    data = b'a' * 100
+    assert list(search_file(io.BytesIO(data), re.compile(b'aa'), overlap=10, chunk_size=16)) == list(range(0, 100, 2))
+
+
+def test_search_empty_file():
+    assert list(search_file(io.BytesIO(b''), re.compile(b'a'))) == []
+
+
+def test_compile_pattern():
+    assert compile_pattern('בדיקה').search('בדיקה'.encode()) is not None
+    assert compile_pattern(b'ABC', re.IGNORECASE).search(b'abc') is not None
+    regex = re.compile(b'a')
+    assert compile_pattern(regex) is regex
@@ -0,0 +1,102 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pyiosbackup.server import BackupServer, _parse_range
+
+DATA = bytes(range(256)) * 4
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+@pytest.fixture
+def server(tmp_path, make_backup, archive_mbfile):
+    (tmp_path / 'bb').mkdir()
+    (tmp_path / 'bb' / ('bb' * 20)).write_bytes(DATA)
+    backup = make_backup([
+        ('aa' * 20, 'HomeDomain', 'Library', 1, archive_mbfile('Library', mode=0o40755, size=0)),
+        ('bb' * 20, 'HomeDomain', 'Library/a b.bin', 1, archive_mbfile('Library/a b.bin', size=len(DATA))),
+        ('dd' * 20, 'HomeDomain', 'Library/missing.bin', 1, archive_mbfile('Library/missing.bin', size=10)),
+        ('cc' * 20, 'HomeDomain', 'Library/link', 1,
+         archive_mbfile('Library/link', mode=0o120755, size=0, link_target='a b.bin')),
+    ], tmp_path)
+    with BackupServer(backup, ('127.0.0.1', 0)) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+        server.shutdown()
+        thread.join()
+
+
+def _get(url, **headers):
+    try:
+        with urllib.request.build_opener(_NoRedirect).open(urllib.request.Request(url, headers=headers)) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_listing(server):
+    status, _, body = _get(f'{server}/', Accept='application/json')
+    assert status == 200
+    assert json.loads(body) == [{'name': 'HomeDomain', 'kind': 'dir', 'href': '/domains/HomeDomain/'}]
+    _, _, body = _get(f'{server}/domains/HomeDomain/Library/', Accept='application/json')
+    assert [(item['name'], item['kind'], item['href']) for item in json.loads(body)] == [
+        ('a b.bin', 'file', '/domains/HomeDomain/Library/a%20b.bin'),
+        ('link', 'symlink', '/domains/HomeDomain/Library/link'),
+        ('missing.bin', 'file', '/domains/HomeDomain/Library/missing.bin'),
+    ]
+    status, headers, body = _get(f'{server}/domains/HomeDomain/')
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/html')
+    assert b'href="/domains/HomeDomain/Library/"' in body
+    assert _get(f'{server}/domains/MissingDomain/')[0] == 404
+
+
+def test_file(server):
+    status, headers, body = _get(f'{server}/domains/HomeDomain/Library/a%20b.bin')
+    assert (status, body) == (200, DATA)
+    assert headers['Accept-Ranges'] == 'bytes'
+    etag = headers['ETag']
+    assert etag.startswith(f'"{"bb" * 20}')
+    assert _get(f'{server}/ids/{"bb" * 20}')[2] == DATA
+    assert _get(f'{server}/ids/{"bb" * 20}', **{'If-None-Match': etag})[0] == 304
+    assert _get(f'{server}/ids/{"ee" * 20}')[0] == 404
+    assert _get(f'{server}/domains/HomeDomain/Library/missing.bin')[0] == 404
+
+
+def test_range(server):
+    url = f'{server}/ids/{"bb" * 20}'
+    status, headers, body = _get(url, Range='bytes=100-199')
+    assert (status, body) == (206, DATA[100:200])
+    assert headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert _get(url, Range='bytes=-10')[2] == DATA[-10:]
+    assert _get(url, Range='bytes=1000-')[2] == DATA[1000:]
+    assert _get(url, Range='bytes=5000-')[0] == 416
+    assert _get(url, Range='bytes=0-1', **{'If-Range': '"other"'})[:3:2] == (200, DATA)
+
+
+def test_symlink_redirect(server):
+    status, headers, _ = _get(f'{server}/domains/HomeDomain/Library/link')
+    assert status == 302
+    assert headers['Location'] == '/domains/HomeDomain/Library/a%20b.bin'
+
+
+@pytest.mark.parametrize('requested_range, expected', [
+    ('bytes=0-9', (0, 10)),
+    ('bytes=90-200', (90, 100)),
+    ('bytes=-200', (0, 100)),
+    ('bytes=-0', None),
+    ('bytes=100-', None),
+    ('bytes=9-5', None),
+    ('bytes=0-1,5-6', (0, 100)),
+    ('items=0-1', (0, 100)),
+])
+def test_parse_range(requested_range, expected):
+    assert _parse_range(requested_range, 100) == expected
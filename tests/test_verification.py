@@ -0,0 +1,53 @@
+import hashlib
+
+import pytest
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from pyiosbackup.verification import encrypted_sizes, hash_entry_file, scan_stored_files
+
+KEY = bytes(range(32))
+
+
+def encrypt(data: bytes) -> bytes:
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(KEY), modes.CBC(b'\x00' * 16)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+@pytest.mark.parametrize('data', [b'', b'Test data', b'A' * 16, bytes(range(256)) * 40])
+def test_hash_entry_file(tmp_path, data):
+    path = tmp_path / 'entry'
+    encrypted = encrypt(data)
+    path.write_bytes(encrypted)
+    assert hash_entry_file(path, KEY, chunk_size=64) == (len(data), hashlib.sha1(data).digest())
+    assert hash_entry_file(path, None, chunk_size=64) == (len(encrypted), hashlib.sha1(encrypted).digest())
+    assert len(encrypted) in encrypted_sizes(len(data))
+
+
+def test_hash_unencrypted_entry_file(tmp_path):
+    path = tmp_path / 'entry'
+    path.write_bytes(b'Test data')
+    assert hash_entry_file(path, None, chunk_size=4) == (9, hashlib.sha1(b'Test data').digest())
+
+
+def test_hash_entry_file_bad_padding(tmp_path):
+    path = tmp_path / 'entry'
+    path.write_bytes(b'\x00' * 32)
+    with pytest.raises(ValueError):
+        hash_entry_file(path, KEY)
+
+
+def test_encrypted_sizes():
+    assert encrypted_sizes(0) == (0, 16)
+    assert encrypted_sizes(9) == (16,)
+    assert encrypted_sizes(16) == (32,)
+
+
+def test_scan_stored_files(tmp_path):
+    (tmp_path / 'aa').mkdir()
+    (tmp_path / 'aa' / ('aa' * 20)).write_bytes(b'a' * 16)
+    (tmp_path / 'Manifest.db').write_bytes(b'')
+    (tmp_path / ('bb' * 20)).write_bytes(b'b' * 32)
+    assert scan_stored_files(tmp_path, True) == {'aa' * 20: 16}
+    assert scan_stored_files(tmp_path, False) == {'bb' * 20: 32}